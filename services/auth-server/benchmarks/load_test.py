@@ -0,0 +1,326 @@
+"""
+Load test for the auth server.
+
+Starts auth-server.py in offline mode against a stub portal that implements the auth code
+endpoints, then logs in with N concurrent quarry clients and measures the time from opening
+the connection to being kicked with an auth code.
+
+    python -m benchmarks.load_test --logins 1000 --concurrency 50
+    python -m benchmarks.load_test --pool-size 0 --portal-latency 50
+
+Nothing here talks to Mojang or the real portal.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime as dt
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from quarry.data.packets import default_protocol_version
+from quarry.net.auth import OfflineProfile
+from quarry.net.client import ClientFactory, ClientProtocol
+from twisted.internet import defer, reactor
+
+LOAD_TEST_AUTH_KEY = "load-test-auth-key"
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "project", "auth-server.py")
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+AUTH_CODE = re.compile(r"\b(\d{6})\b")
+
+
+class StubPortal:
+    """
+    Stands in for the portal's /api/auth/minecraft endpoints, answering the same way they do.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.codes = {}
+        self.codes_by_uuid = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, count):
+        with self._lock:
+            reserved = []
+            while len(reserved) < count:
+                code = random.randint(0, 999999)
+                if code not in self.codes:
+                    self.codes[code] = None
+                    reserved.append(code)
+        return 200, {"codes": reserved}
+
+    def authenticate(self, data):
+        uuid = data.get("uuid")
+        auth_code = data.get("auth_code")
+        if not uuid or not data.get("display_name") or not auth_code:
+            return 400, {"msg": "Missing data in request"}
+        auth_code = int(auth_code)
+        with self._lock:
+            if auth_code in self.codes and self.codes[auth_code] is None:
+                self.codes[auth_code] = uuid
+                self.codes_by_uuid[uuid] = auth_code
+                return 200, {"msg": "Auth code bound"}
+            if uuid in self.codes_by_uuid:
+                return 400, {"msg": "UUID already exists", "auth_code": self.codes_by_uuid[uuid]}
+            if auth_code in self.codes:
+                return 400, {"msg": "Auth code already used"}
+            self.codes[auth_code] = uuid
+            self.codes_by_uuid[uuid] = auth_code
+        return 200, {"msg": "Auth code added"}
+
+    def handle(self, path, data):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if path == "/api/auth/minecraft":
+            return self.authenticate(data)
+        if path == "/api/auth/minecraft/codes":
+            return self.reserve(int(data.get("count", 0)))
+        return 404, {"msg": "Not found"}
+
+    def serve(self):
+        portal = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("Authorization") != LOAD_TEST_AUTH_KEY:
+                    status, response = 401, {"msg": "Invalid auth key"}
+                else:
+                    status, response = portal.handle(self.path, json.loads(body or "{}"))
+                payload = json.dumps(response).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *_args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+class LoadTestProtocol(ClientProtocol):
+    def packet_login_disconnect(self, buff):
+        self.factory.kicked(buff.unpack_chat().to_string())
+        self.close()
+
+    packet_disconnect = packet_login_disconnect
+
+    def connection_lost(self, reason=None):
+        ClientProtocol.connection_lost(self, reason)
+        self.factory.finished("lost", "Connection closed before being kicked")
+
+
+class LoadTestFactory(ClientFactory):
+    """
+    One login, `result` fires with (outcome, seconds, detail) once it's over.
+    """
+    protocol = LoadTestProtocol
+    # Skip the status ping quarry would otherwise open a second connection for
+    force_protocol_version = default_protocol_version
+
+    def __init__(self, display_name, timeout):
+        ClientFactory.__init__(self, OfflineProfile.from_display_name(display_name))
+        self.log_level = logging.ERROR
+        self.result = defer.Deferred()
+        self._started = None
+        self._timeout = timeout
+        self._timer = None
+
+    def start(self, host, port):
+        self._started = time.perf_counter()
+        self._timer = reactor.callLater(self._timeout, self.finished, "timeout", "No kick within the timeout")
+        self.connect(host, port)
+        return self.result
+
+    def kicked(self, reason):
+        match = AUTH_CODE.search(reason)
+        if match:
+            self.finished("code", match.group(1))
+        else:
+            self.finished("rejected", reason.strip())
+
+    def clientConnectionFailed(self, _connector, reason):
+        self.finished("failed", reason.getErrorMessage())
+
+    def finished(self, outcome, detail):
+        if self.result.called:
+            return
+        if self._timer.active():
+            self._timer.cancel()
+        self.result.callback((outcome, time.perf_counter() - self._started, detail))
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def wait_for_port(host, port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"The auth server exited with code {process.returncode}")
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    sys.exit(f"The auth server didn't start listening on port {port}")
+
+
+def start_auth_server(args, portal_url):
+    env = dict(os.environ)
+    env.update({
+        "WEB_SERVER_URL": portal_url,
+        "AUTH_KEY": LOAD_TEST_AUTH_KEY,
+        "AUTH_SERVER_PORT": str(args.port),
+        "AUTH_SERVER_ONLINE_MODE": "false",
+        "AUTH_CODE_POOL_SIZE": str(args.pool_size),
+        "AUTH_CODE_POOL_LOW_WATER": str(args.pool_low_water),
+        "PYTHONUNBUFFERED": "1"
+    })
+    log = open(args.server_log, "w") if args.server_log else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, SERVER_SCRIPT], env=env, stdout=log, stderr=subprocess.STDOUT)
+    wait_for_port("127.0.0.1", args.port, process)
+    return process
+
+
+@defer.inlineCallbacks
+def drive(args):
+    semaphore = defer.DeferredSemaphore(args.concurrency)
+    run_id = random.randint(0, 99999)
+
+    def login(i):
+        # Offline UUIDs come from the name, so every login is a player the portal hasn't seen
+        factory = LoadTestFactory(f"lt{run_id}_{i}"[:16], args.timeout)
+        return factory.start("127.0.0.1", args.port)
+
+    started = time.perf_counter()
+    results = yield defer.gatherResults([semaphore.run(login, i) for i in range(args.logins)])
+    return results, time.perf_counter() - started
+
+
+def summarise(results, elapsed):
+    timings = sorted(seconds * 1000 for outcome, seconds, _ in results if outcome == "code")
+    outcomes = {}
+    reasons = {}
+    for outcome, _, detail in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+        if outcome != "code":
+            reasons[detail] = reasons.get(detail, 0) + 1
+    codes = [detail for outcome, _, detail in results if outcome == "code"]
+    return {
+        "logins": len(results),
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_s": round(len(timings) / elapsed, 2) if elapsed else None,
+        "outcomes": outcomes,
+        "duplicate_codes": len(codes) - len(set(codes)),
+        "mean_ms": round(sum(timings) / len(timings), 3) if timings else None,
+        "p50_ms": round(percentile(timings, 50), 3) if timings else None,
+        "p90_ms": round(percentile(timings, 90), 3) if timings else None,
+        "p99_ms": round(percentile(timings, 99), 3) if timings else None,
+        "max_ms": round(timings[-1], 3) if timings else None,
+        "failure_reasons": reasons
+    }
+
+
+def run(args):
+    portal = StubPortal(args.portal_latency / 1000)
+    portal_server = portal.serve()
+    portal_url = f"http://127.0.0.1:{portal_server.server_address[1]}"
+    process = start_auth_server(args, portal_url)
+    # Give the auth server a moment to fill its code pool before the first login
+    time.sleep(args.settle)
+
+    outcome = {}
+
+    def done(result):
+        outcome["result"] = result
+        reactor.stop()
+
+    def failed(failure):
+        outcome["failure"] = failure
+        reactor.stop()
+
+    reactor.callWhenRunning(lambda: drive(args).addCallbacks(done, failed))
+    try:
+        reactor.run()
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        portal_server.shutdown()
+    if "failure" in outcome:
+        outcome["failure"].raiseException()
+
+    results, elapsed = outcome["result"]
+    summary = summarise(results, elapsed)
+    summary["portal_requests"] = portal.requests
+    print(f"{summary['logins']} logins, {args.concurrency} concurrent, in {summary['elapsed_s']}s")
+    print(f"  kicked with a code   {summary['outcomes'].get('code', 0):>8}  ({summary['throughput_per_s']}/s)")
+    for outcome_name in ("rejected", "lost", "failed", "timeout"):
+        if summary["outcomes"].get(outcome_name):
+            print(f"  {outcome_name:<20} {summary['outcomes'][outcome_name]:>8}")
+    if summary["p50_ms"] is not None:
+        print(f"  connect to kick      p50 {summary['p50_ms']:.2f}ms  p90 {summary['p90_ms']:.2f}ms  "
+              f"p99 {summary['p99_ms']:.2f}ms  max {summary['max_ms']:.2f}ms")
+    if summary["duplicate_codes"]:
+        print(f"  {summary['duplicate_codes']} players were given a code someone else already had")
+    for reason, count in sorted(summary["failure_reasons"].items(), key=lambda r: -r[1]):
+        print(f"  {count:>6} x {reason}")
+    print(f"  portal requests      {summary['portal_requests']:>8}")
+
+    report = {
+        "meta": {
+            "timestamp": dt.utcnow().isoformat(),
+            "logins": args.logins,
+            "concurrency": args.concurrency,
+            "pool_size": args.pool_size,
+            "pool_low_water": args.pool_low_water,
+            "portal_latency_ms": args.portal_latency
+        },
+        "results": summary
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"load_{dt.utcnow().strftime('%Y%m%dT%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the auth server with concurrent offline logins")
+    parser.add_argument("--logins", type=int, default=500, help="Total number of logins")
+    parser.add_argument("--concurrency", type=int, default=25, help="Logins in flight at once")
+    parser.add_argument("--timeout", type=float, default=30, help="Seconds to wait for a kick")
+    parser.add_argument("--port", type=int, default=25599, help="Port to run the auth server on")
+    parser.add_argument("--pool-size", type=int, default=50, help="AUTH_CODE_POOL_SIZE, 0 disables the pool")
+    parser.add_argument("--pool-low-water", type=int, default=10, help="AUTH_CODE_POOL_LOW_WATER")
+    parser.add_argument("--portal-latency", type=float, default=0, help="Milliseconds the stub portal waits per request")
+    parser.add_argument("--settle", type=float, default=1, help="Seconds to wait after the auth server starts")
+    parser.add_argument("--server-log", help="Write the auth server's output to this file")
+    parser.add_argument("--output", help="Where to write the JSON results")
+    main_args = parser.parse_args()
+    run(main_args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,17 @@
 import os
 import random
+import time
+from collections import deque
 
 import requests
 from quarry.net.server import ServerFactory, ServerProtocol
 from twisted.internet import reactor
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
 
 base_web_url = os.getenv("WEB_SERVER_URL", "http://localhost:8080")
 new_user_url = f"{base_web_url}/api/auth/minecraft"
+reserve_codes_url = f"{base_web_url}/api/auth/minecraft/codes"
 AUTH_KEY = os.getenv("AUTH_KEY", None)
 if not AUTH_KEY:
     raise Exception("AUTH_KEY environment variable not set")
@@ -14,6 +19,25 @@ if not AUTH_KEY:
 headers = {
     "Authorization": f"{AUTH_KEY}",
 }
+REQUEST_TIMEOUT = float(os.getenv("PORTAL_REQUEST_TIMEOUT", "5"))
+HTTP_THREADS = int(os.getenv("PORTAL_HTTP_THREADS", "10"))
+CODE_POOL_SIZE = int(os.getenv("AUTH_CODE_POOL_SIZE", "50"))
+CODE_POOL_LOW_WATER = int(os.getenv("AUTH_CODE_POOL_LOW_WATER", "10"))
+# Don't hand out reserved codes the portal may have expired in the meantime
+CODE_MAX_AGE = int(os.getenv("AUTH_CODE_MAX_AGE", "1800"))
+BIND_RETRIES = 5
+LISTEN_PORT = int(os.getenv("AUTH_SERVER_PORT", "25565"))
+# Only turn this off for local testing, nobody's account is checked with Mojang without it
+ONLINE_MODE = os.getenv("AUTH_SERVER_ONLINE_MODE", "true").lower() != "false"
+# Every player is kicked as soon as they have their code, so this only caps logins in flight at once
+MAX_PLAYERS = int(os.getenv("AUTH_SERVER_MAX_PLAYERS", "10000"))
+
+# Portal calls block, so they run on this pool instead of the reactor thread.
+# The session keeps connections to the portal alive between logins.
+http_pool = ThreadPool(minthreads=1, maxthreads=HTTP_THREADS, name="portal-http")
+session = requests.Session()
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=HTTP_THREADS))
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=HTTP_THREADS))
 
 
 def generate_auth_code():
@@ -24,33 +48,115 @@ def generate_auth_code():
     return auth_code
 
 
-def send_auth_code(display_name, uuid, ip_address):
-    generated_code = generate_auth_code()
-    post_dict = {
-        "uuid": str(uuid),
-        "display_name": display_name,
-        "ip_address": ip_address,
-        "auth_code": generated_code
-    }
-    response = requests.post(new_user_url, json=post_dict, headers=headers)
-    if response.status_code == 200:
-        # Kick them with the auth code
-        return generated_code
-    elif response.status_code == 400:
-        # Check what the return msg is
-        if response.json()["msg"] == "Auth code already used":
-            # We need to re-fire this request
-            print(f"Auth code for {display_name} already used, re-sending")
-            send_auth_code(display_name, uuid, ip_address)
-        elif response.json()["msg"] == "UUID already exists":
-            # User has already authed once but never used the code, send back the code we already have for them
-            auth_code = response.json()["auth_code"]
-            print(f"User {display_name} has already authed but never used the code, sending back code {auth_code}")
-            return auth_code
-    elif response.status_code == 401:
-        print("Invalid AUTH_KEY")
+def send_auth_code(display_name, uuid, ip_address, auth_code=None, attempts=5):
+    for _ in range(attempts):
+        generated_code = auth_code or generate_auth_code()
+        post_dict = {
+            "uuid": str(uuid),
+            "display_name": display_name,
+            "ip_address": ip_address,
+            "auth_code": generated_code
+        }
+        response = session.post(new_user_url, json=post_dict, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 200:
+            # Kick them with the auth code
+            return generated_code
+        elif response.status_code == 400:
+            # Check what the return msg is
+            if response.json()["msg"] == "Auth code already used":
+                if auth_code:
+                    # A code from our pool can't be swapped for another, they've already been shown it
+                    print(f"Reserved auth code {auth_code} for {display_name} was already used")
+                    return None
+                # We need to re-fire this request
+                print(f"Auth code for {display_name} already used, re-sending")
+                continue
+            elif response.json()["msg"] == "UUID already exists":
+                # User has already authed once but never used the code, send back the code we already have for them
+                existing_code = str(response.json()["auth_code"]).zfill(6)
+                print(f"User {display_name} has already authed but never used the code, sending back code {existing_code}")
+                return existing_code
+            return None
+        elif response.status_code == 401:
+            print("Invalid AUTH_KEY")
+            return None
+        else:
+            return None
+    return None
+
+
+def reserve_auth_codes(count):
+    response = session.post(reserve_codes_url, json={"count": count}, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        print(f"Failed to reserve auth codes: {response.status_code}")
+        return []
+    return [str(code).zfill(6) for code in response.json()["codes"]]
+
+
+class AuthCodePool:
+    """
+    Auth codes the portal has reserved for us, so a player can be given one without waiting on the portal.
+    Refills happen in the background once the pool runs low. Only touched from the reactor thread.
+    """
+
+    def __init__(self, size, low_water):
+        self.size = size
+        self.low_water = low_water
+        self._codes = deque()
+        self._refilling = False
+
+    def take(self):
+        while self._codes:
+            code, reserved_at = self._codes.popleft()
+            if time.monotonic() - reserved_at < CODE_MAX_AGE:
+                self.refill_if_low()
+                return code
+        self.refill_if_low()
         return None
 
+    def refill_if_low(self):
+        if self._refilling or len(self._codes) > self.low_water:
+            return
+        self._refilling = True
+        d = deferToThreadPool(reactor, http_pool, reserve_auth_codes, self.size - len(self._codes))
+        d.addCallback(self._refilled)
+        d.addErrback(self._refill_failed)
+
+    def _refilled(self, codes):
+        self._refilling = False
+        reserved_at = time.monotonic()
+        self._codes.extend((code, reserved_at) for code in codes)
+        print(f"Auth code pool refilled, {len(self._codes)} codes available")
+
+    def _refill_failed(self, failure):
+        self._refilling = False
+        print(f"Failed to refill the auth code pool: {failure.getErrorMessage()}")
+
+
+code_pool = AuthCodePool(CODE_POOL_SIZE, CODE_POOL_LOW_WATER)
+# Codes we've already given each player, so rejoining shows them the same one
+issued_codes = {}
+
+
+def bind_auth_code(display_name, uuid, ip_address, auth_code, attempt=0):
+    d = deferToThreadPool(reactor, http_pool, send_auth_code, display_name, uuid, ip_address, auth_code, 1)
+
+    def bound(result):
+        # Anything other than our code back means the portal didn't accept it for this player
+        if result != auth_code:
+            issued_codes.pop(uuid, None)
+            print(f"Failed to bind auth code {auth_code} to {display_name} ({uuid})")
+
+    def failed(failure):
+        if attempt + 1 >= BIND_RETRIES:
+            issued_codes.pop(uuid, None)
+            print(f"Giving up binding auth code {auth_code} to {display_name}: {failure.getErrorMessage()}")
+            return
+        # The player already has their code, keep trying for a while so it works when they enter it
+        reactor.callLater(2 ** attempt, bind_auth_code, display_name, uuid, ip_address, auth_code, attempt + 1)
+
+    d.addCallbacks(bound, failed)
+
 
 class AuthProtocol(ServerProtocol):
     def player_joined(self):
@@ -61,7 +167,31 @@ class AuthProtocol(ServerProtocol):
         ip_address = self.remote_addr.host
         print(f"{display_name} has joined with UUID {uuid} and IP {ip_address}")
 
-        generated_code = send_auth_code(display_name, uuid, ip_address)
+        now = time.monotonic()
+        for expired in [key for key, (_, issued_at) in issued_codes.items() if now - issued_at >= CODE_MAX_AGE]:
+            del issued_codes[expired]
+        issued = issued_codes.get(uuid)
+        if issued:
+            self.auth_code_received(issued[0])
+            return
+
+        auth_code = code_pool.take()
+        if auth_code:
+            # Kick them straight away, the portal learns who the code belongs to in the background
+            issued_codes[uuid] = (auth_code, now)
+            self.auth_code_received(auth_code)
+            bind_auth_code(display_name, uuid, ip_address, auth_code)
+            return
+
+        # The pool's empty, fall back to asking the portal. Don't hold up the reactor while we wait
+        d = deferToThreadPool(reactor, http_pool, send_auth_code, display_name, uuid, ip_address)
+        d.addCallback(self.auth_code_received)
+        d.addErrback(self.auth_code_failed)
+
+    def auth_code_received(self, generated_code):
+        display_name = self.display_name
+        uuid = self.uuid
+        ip_address = self.remote_addr.host
         if generated_code:
             print(
                 f"{display_name} ({uuid}) ({ip_address}) has joined the server. Generated auth code: {generated_code}")
@@ -71,20 +201,31 @@ class AuthProtocol(ServerProtocol):
             print(f"{display_name} ({uuid}) ({ip_address}) has joined the server. Failed to generate auth code.")
             self.close("\u00A7bFailed to Authenticate!\nPlease try again later.")
 
+    def auth_code_failed(self, failure):
+        print(f"Failed to get an auth code for {self.display_name}: {failure.getErrorMessage()}")
+        self.close("\u00A7bFailed to Authenticate!\nPlease try again later.")
+
 
 class AuthFactory(ServerFactory):
     protocol = AuthProtocol
     motd = "SwarmSMP Auth Server"
-    max_players = 1
+    max_players = MAX_PLAYERS
 
 
 def main():
     factory = AuthFactory()
+    factory.online_mode = ONLINE_MODE
+
+    print(f"Listening on port {LISTEN_PORT}")
+    if not ONLINE_MODE:
+        print("Running in offline mode, players are not verified")
 
-    print("Listening on port 25565")
+    http_pool.start()
+    reactor.addSystemEventTrigger("during", "shutdown", http_pool.stop)
+    reactor.callWhenRunning(code_pool.refill_if_low)
 
     # skipcq: BAN-B104
-    factory.listen("0.0.0.0", 25565)
+    factory.listen("0.0.0.0", LISTEN_PORT)
     reactor.run()
 
 
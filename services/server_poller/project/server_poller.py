@@ -2,6 +2,8 @@ import requests
 import os
 import time
 import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 PANEL_API_URL = os.getenv('PANEL_API_URL', 'http://localhost:5000')
 PANEL_API_KEY = os.getenv('PANEL_API_KEY', 'secret')
@@ -10,7 +12,20 @@ STAGING_SERVER_UUID = os.getenv('STAGING_SERVER_UUID', '123456789')
 FALLBACK_SERVER_UUID = os.getenv('FALLBACK_SERVER_UUID', '123456789')
 PORTAL_API_KEY = os.getenv('AUTH_KEY', 'secret')
 WEB_SERVER_URL = os.getenv("WEB_SERVER_URL", "http://localhost:8080")
-UUIDS = [LIVE_SERVER_UUID, STAGING_SERVER_UUID, FALLBACK_SERVER_UUID]
+# Comma separated list of every server to poll, defaults to the live, staging and fallback servers
+SERVER_UUIDS = os.getenv('SERVER_UUIDS', f"{LIVE_SERVER_UUID},{STAGING_SERVER_UUID},{FALLBACK_SERVER_UUID}")
+UUIDS = list(dict.fromkeys(uuid.strip() for uuid in SERVER_UUIDS.split(',') if uuid.strip()))
+REQUEST_TIMEOUT = float(os.getenv('POLLER_REQUEST_TIMEOUT', '10'))
+MAX_WORKERS = int(os.getenv('POLLER_MAX_WORKERS', '8'))
+POLL_INTERVAL = int(os.getenv('POLLER_INTERVAL', '60'))
+# Publish at least this often even if nothing changed, so the portal knows we're still alive
+HEARTBEAT_INTERVAL = int(os.getenv('POLLER_HEARTBEAT_INTERVAL', '900'))
+
+# Keep-alive connections to the panel and the portal, reused every cycle
+session = requests.Session()
+session.mount('http://', requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS))
+executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
 
 headers = {
         'Authorization': f"{PORTAL_API_KEY}",
@@ -23,10 +38,10 @@ def get_status_for_server(server_uuid):
     print(f"Getting status for server {server_uuid}")
     local_headers = {'Authorization': f'Bearer {PANEL_API_KEY}'}
     try:
-        response = requests.get(url, headers=local_headers)
+        response = session.get(url, headers=local_headers, timeout=REQUEST_TIMEOUT)
         return response.json()
-    except requests.exceptions.ConnectionError:
-        print(f"Error getting status for server {server_uuid}")
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f"Error getting status for server {server_uuid}: {e}")
         return {'status': 0}
 
 
@@ -51,39 +66,97 @@ def get_player_list(status_json):
         return []
 
 
-def get_status_for_servers():
+def get_resource_usage(status_json):
+    # Depending on the panel version usage is either top level or under "resources"
+    resources = status_json.get('resources') if isinstance(status_json.get('resources'), dict) else status_json
+    cpu = resources.get('cpu', resources.get('cpu_absolute'))
+    memory = resources.get('memory', resources.get('memory_bytes'))
+    return {
+        'cpu': cpu if isinstance(cpu, (int, float)) else None,
+        'memory': memory if isinstance(memory, (int, float)) else None
+    }
+
+
+def get_status_for_servers(server_uuids=None):
+    server_uuids = UUIDS if server_uuids is None else server_uuids
     output_json = {}
-    for uuid in UUIDS:
+    # Poll every server at once, a slow one only holds up the cycle until it times out
+    statuses = executor.map(get_status_for_server, server_uuids)
+    for uuid, status_json in zip(server_uuids, statuses):
         output_json[uuid] = {}
-        status_json = get_status_for_server(uuid)
         if is_server_online(status_json):
             output_json[uuid]["online"] = True
             player_list = get_player_list(status_json)
             output_json[uuid]["player_list"] = player_list
+            output_json[uuid].update(get_resource_usage(status_json))
         else:
             output_json[uuid]["online"] = False
             output_json[uuid]["player_list"] = []
+            output_json[uuid].update({'cpu': None, 'memory': None})
     return output_json
 
 
+def get_fingerprint(status):
+    # Only the online state and who's online matter, player order doesn't
+    snapshot = {
+        uuid: [server['online'], sorted(server['player_list'])]
+        for uuid, server in status.items()
+    }
+    return hashlib.sha256(json.dumps(snapshot, sort_keys=True).encode()).hexdigest()
+
+
+def get_metrics(status):
+    return {
+        uuid: {
+            'players': len(server['player_list']),
+            'cpu': server['cpu'],
+            'memory': server['memory']
+        }
+        for uuid, server in status.items()
+    }
+
+
+def post_metrics_to_portal(data):
+    url = f'{WEB_SERVER_URL}/api/server_metrics'
+    response = session.post(url, headers=headers, json=data, timeout=REQUEST_TIMEOUT)
+    if response.status_code != 200:
+        print(f"Error posting metrics to portal: {response.status_code}")
+
+
 def post_data_to_portal(data):
     url = f'{WEB_SERVER_URL}/api/update_server_status'
-    response = requests.post(url, headers=headers, json=data)
+    response = session.post(url, headers=headers, json=data, timeout=REQUEST_TIMEOUT)
     if response.status_code != 200:
         try:
             response_json = response.json()
             print(f"Error posting data to portal: {response_json['msg']}")
         except json.decoder.JSONDecodeError:
             print("Error posting data to portal")
-    else:
-        print("Successfully posted data to portal")
+        return False
+    print("Successfully posted data to portal")
+    return True
 
 
-while True:
-    output = get_status_for_servers()
-    print(output)
-    try:
-        post_data_to_portal(output)
-    except requests.exceptions.ConnectionError:
-        print("Error posting data to portal")
-    time.sleep(60)
+if __name__ == '__main__':
+    last_fingerprint = None
+    last_published = 0
+    while True:
+        output = get_status_for_servers()
+        print(output)
+        try:
+            # Metrics are small and go every cycle, the full status only when it changes
+            post_metrics_to_portal(get_metrics(output))
+        except requests.exceptions.RequestException:
+            print("Error posting metrics to portal")
+        fingerprint = get_fingerprint(output)
+        if fingerprint != last_fingerprint or time.monotonic() - last_published >= HEARTBEAT_INTERVAL:
+            try:
+                # Only remember what we published if it went through, otherwise we retry next cycle
+                if post_data_to_portal(output):
+                    last_fingerprint = fingerprint
+                    last_published = time.monotonic()
+            except requests.exceptions.RequestException:
+                print("Error posting data to portal")
+        else:
+            print("Nothing changed, skipping publish")
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,154 @@
+import random
+import uuid
+from datetime import datetime as dt
+from datetime import timedelta
+
+from project.models import db, User, Faction, Class, Race, Character, Application, AuditLog, Ticket, TicketReply, \
+    TicketDepartment, SystemSetting, ServerStatus
+
+BENCH_PASSWORD = "benchmark"
+LIVE_SERVER_UUID = "00000000-0000-4000-8000-000000000001"
+STAGING_SERVER_UUID = "00000000-0000-4000-8000-000000000002"
+FALLBACK_SERVER_UUID = "00000000-0000-4000-8000-000000000003"
+SERVER_UUIDS = [LIVE_SERVER_UUID, STAGING_SERVER_UUID, FALLBACK_SERVER_UUID]
+
+
+def make_status_payload(rng, players=20):
+    payload = {}
+    for server_uuid in SERVER_UUIDS:
+        player_list = [f"player{rng.randint(0, 9999)}" for _ in range(players)] if server_uuid == LIVE_SERVER_UUID else []
+        payload[server_uuid] = {"online": True, "player_list": player_list}
+    return payload
+
+
+def seed(users=2000, audit_logs=50000, ticket_replies=50, server_statuses=1440, seed_value=1):
+    """
+    Fill an empty database with a realistic amount of data
+    :param users: Number of users, about half of them whitelisted with a character
+    :param audit_logs: Number of audit log rows
+    :param ticket_replies: Number of replies on the benchmarked ticket
+    :param server_statuses: Number of server status rows, one per minute
+    :param seed_value: Seed for the random generator so runs are comparable
+
+    :return: Dict describing what was seeded and the ids the benchmarks need
+    """
+    rng = random.Random(seed_value)
+    now = dt.utcnow()
+
+    settings = SystemSetting()
+    settings.live_server_uuid = LIVE_SERVER_UUID
+    settings.staging_server_uuid = STAGING_SERVER_UUID
+    settings.fallback_server_uuid = FALLBACK_SERVER_UUID
+    db.session.add(settings)
+
+    factions = [Faction(name=f"Faction {i}", commands="", role=None) for i in range(5)]
+    db.session.add_all(factions)
+    db.session.flush()
+    classes = [Class(name=f"Class {i}", commands="") for i in range(8)]
+    races = [Race(name=f"Race {i}", faction_id=factions[i % len(factions)].id, commands="") for i in range(8)]
+    for clazz in classes:
+        clazz.hidden = False
+        clazz.faction_id = factions[rng.randrange(len(factions))].id
+    for race in races:
+        race.hidden = False
+    db.session.add_all(classes + races)
+    db.session.flush()
+
+    admin = User(username="bench_admin", password=BENCH_PASSWORD, email="admin@bench.local",
+                 discord_uuid="1", minecraft_username="bench_admin", minecraft_uuid=str(uuid.uuid4()))
+    admin.is_admin = True
+    admin.is_whitelisted = True
+    db.session.add(admin)
+
+    user_rows = []
+    for i in range(users):
+        whitelisted = i % 2 == 0
+        user_rows.append({
+            "session_id": uuid.uuid4(),
+            "username": f"bench_user_{i}",
+            "password": BENCH_PASSWORD,
+            "email": f"user{i}@bench.local",
+            "discord_uuid": str(100000 + i) if i % 5 else None,
+            "minecraft_username": f"bench_mc_{i}" if i % 5 else None,
+            "minecraft_uuid": str(uuid.uuid4()) if i % 5 else None,
+            "is_admin": False,
+            "is_staff": i % 50 == 0,
+            "is_banned": i % 97 == 0,
+            "is_whitelisted": whitelisted and i % 5 != 0,
+            "email_confirmed": True,
+            "created_at": now - timedelta(minutes=users - i),
+            "updated_at": now - timedelta(minutes=users - i)
+        })
+    db.session.execute(User.__table__.insert(), user_rows)
+    db.session.flush()
+
+    whitelisted = User.query.filter(User.is_whitelisted.is_(True), User.id != admin.id).all()
+    characters = []
+    applications = []
+    for user in whitelisted:
+        faction = factions[rng.randrange(len(factions))]
+        characters.append(Character(
+            user_id=user.id, name=f"Character of {user.username}", faction=faction,
+            subrace=races[rng.randrange(len(races))].id, clazz=classes[rng.randrange(len(classes))].id,
+            backstory="A long backstory. " * 20, description="A description. " * 10,
+            starting_power={}, is_permad=False, scale="1.0"
+        ))
+        application = Application(
+            user=user, character_name=f"Character of {user.username}", character_faction=faction.id,
+            character_race=races[0].id, character_class=classes[0].id,
+            backstory="A long backstory. " * 20, description="A description. " * 10, scale="1.0"
+        )
+        application.is_accepted = True
+        applications.append(application)
+    for character in characters:
+        character.is_active = True
+    db.session.add_all(characters + applications)
+    db.session.flush()
+
+    user_ids = [row.id for row in db.session.query(User.id).all()]
+    batch = []
+    for i in range(audit_logs):
+        batch.append({
+            "id": uuid.uuid4(),
+            "user_id": rng.choice(user_ids),
+            "action": rng.choice(["LOGIN", "CONNECT", "DEV_STATUS True", "STAFF_STATUS False"]),
+            "target_id": 0,
+            "target_type": "N/A",
+            "created_at": now - timedelta(seconds=audit_logs - i),
+            "updated_at": now - timedelta(seconds=audit_logs - i)
+        })
+        if len(batch) == 5000:
+            db.session.execute(AuditLog.__table__.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(AuditLog.__table__.insert(), batch)
+
+    department = TicketDepartment(name="General", description="General support")
+    db.session.add(department)
+    db.session.flush()
+    ticket_owner = whitelisted[0]
+    ticket = Ticket(owner=ticket_owner, subject="Benchmark ticket", department=department)
+    db.session.add(ticket)
+    db.session.flush()
+    for i in range(ticket_replies):
+        author = ticket_owner if i % 2 == 0 else admin
+        db.session.add(TicketReply(ticket=ticket, user=author, content=f"Reply number {i}. " * 5))
+
+    status_rows = []
+    for i in range(server_statuses):
+        status_rows.append({
+            "id": uuid.uuid4(),
+            "status_json": make_status_payload(rng),
+            "created_at": now - timedelta(minutes=server_statuses - i),
+            "updated_at": now - timedelta(minutes=server_statuses - i)
+        })
+    db.session.execute(ServerStatus.__table__.insert(), status_rows)
+    db.session.commit()
+
+    return {
+        "users": users,
+        "whitelisted_users": len(whitelisted),
+        "audit_logs": audit_logs,
+        "ticket_replies": ticket_replies,
+        "server_statuses": server_statuses
+    }
@@ -1,10 +1,8 @@
 import os
-import pickle
 import uuid
 import requests
 from datetime import datetime as dt
 from datetime import timedelta
-from threading import Thread
 
 import sentry_sdk
 from flask import render_template, request, flash, redirect, url_for, send_from_directory
@@ -19,11 +17,22 @@ from .blueprints.api import api as api_blueprint
 from .blueprints.auth import auth_bp as auth_blueprint
 from .blueprints.ticket import ticket_bp as ticket_blueprint
 from .blueprints.user import user_bp as user_blueprint
+from .audit_writer import audit_writer
+from .auth_codes import sweep_auth_codes
+from .cache_stats import instrument_cache
+from .command_dispatcher import dispatch_due_commands
 from .decorators import fully_authenticated
-from .extensions import cache, app
+from .extensions import cache, app, invalidation_bus
 from .models import db, User, Faction, Application, Class, Race
+from .session_cache import SessionUser, get_cached_session, set_cached_session, init_app as init_session_cache
+from .presence import presence
+from .server_metrics import server_metrics, prune_server_metrics
+from .server_status import prune_server_statuses
 from .settings_helper import get_site_settings
+from .sql_profiler import sql_profiler
+from .webhook_queue import webhook_queue
 from .webhooks import new_application
+from .worker import worker
 
 development_env = os.getenv("ENVIRONMENT", "development") == "development"
 
@@ -92,6 +101,52 @@ app.config["CACHE_REDIS_PORT"] = int(os.getenv("CACHE_REDIS_PORT", "6379"))
 app.config["CACHE_REDIS_DB"] = int(os.getenv("CACHE_REDIS_DB", "0"))
 app.config["CACHE_REDIS_URL"] = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
 app.config["CACHE_DEFAULT_TIMEOUT"] = int(os.getenv("CACHE_DEFAULT_TIMEOUT", "300"))
+app.config["CACHE_STATS_ENABLED"] = os.getenv("CACHE_STATS_ENABLED", "True") == "True"
+app.config["SESSION_LOCAL_CACHE_SIZE"] = int(os.getenv("SESSION_LOCAL_CACHE_SIZE", "1024"))
+app.config["SESSION_LOCAL_CACHE_TTL"] = int(os.getenv("SESSION_LOCAL_CACHE_TTL", "30"))
+
+# SQL profiler, off unless asked for outside of development and benchmark runs
+sql_profiler_default = os.environ.get("ENVIRONMENT") in ("development", "benchmark")
+app.config["SQL_PROFILER_ENABLED"] = os.getenv("SQL_PROFILER_ENABLED", str(sql_profiler_default)) == "True"
+app.config["SQL_PROFILER_HISTORY"] = int(os.getenv("SQL_PROFILER_HISTORY", "100"))
+app.config["SQL_PROFILER_MIN_STATEMENTS"] = int(os.getenv("SQL_PROFILER_MIN_STATEMENTS", "20"))
+app.config["SQL_PROFILER_N_PLUS_ONE_THRESHOLD"] = int(os.getenv("SQL_PROFILER_N_PLUS_ONE_THRESHOLD", "5"))
+app.config["SQL_PROFILER_SLOW_REQUEST_MS"] = int(os.getenv("SQL_PROFILER_SLOW_REQUEST_MS", "250"))
+
+# Webhooks
+app.config["WEBHOOK_WORKERS"] = int(os.getenv("WEBHOOK_WORKERS", "2"))
+app.config["WEBHOOK_MAX_ATTEMPTS"] = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "5"))
+app.config["WEBHOOK_TIMEOUT"] = int(os.getenv("WEBHOOK_TIMEOUT", "10"))
+app.config["WEBHOOK_COALESCE_WINDOW"] = float(os.getenv("WEBHOOK_COALESCE_WINDOW", "2"))
+
+# Command queue
+app.config["COMMAND_DISPATCH_DELAY"] = int(os.getenv("COMMAND_DISPATCH_DELAY", "30"))
+app.config["COMMAND_DISPATCH_INTERVAL"] = float(os.getenv("COMMAND_DISPATCH_INTERVAL", "5"))
+app.config["COMMAND_DISPATCH_BATCH_SIZE"] = int(os.getenv("COMMAND_DISPATCH_BATCH_SIZE", "50"))
+
+# Server status
+app.config["SERVER_STATUS_RETENTION_HOURS"] = int(os.getenv("SERVER_STATUS_RETENTION_HOURS", "24"))
+app.config["SERVER_STATUS_PRUNE_INTERVAL"] = float(os.getenv("SERVER_STATUS_PRUNE_INTERVAL", "300"))
+app.config["SERVER_STATUS_PRUNE_BATCH_SIZE"] = int(os.getenv("SERVER_STATUS_PRUNE_BATCH_SIZE", "1000"))
+app.config["SERVER_METRICS_BUFFER_SIZE"] = int(os.getenv("SERVER_METRICS_BUFFER_SIZE", "1440"))
+app.config["SERVER_METRICS_FLUSH_INTERVAL"] = float(os.getenv("SERVER_METRICS_FLUSH_INTERVAL", "60"))
+app.config["SERVER_METRICS_MINUTE_RETENTION_DAYS"] = int(os.getenv("SERVER_METRICS_MINUTE_RETENTION_DAYS", "7"))
+app.config["SERVER_METRICS_HOUR_RETENTION_DAYS"] = int(os.getenv("SERVER_METRICS_HOUR_RETENTION_DAYS", "180"))
+
+# Minecraft auth codes, the TTL has to outlast how long the auth server holds on to reserved codes
+app.config["MINECRAFT_AUTH_CODE_TTL_HOURS"] = int(os.getenv("MINECRAFT_AUTH_CODE_TTL_HOURS", "24"))
+app.config["MINECRAFT_AUTH_CODE_SWEEP_INTERVAL"] = float(os.getenv("MINECRAFT_AUTH_CODE_SWEEP_INTERVAL", "900"))
+app.config["MINECRAFT_AUTH_CODE_SWEEP_BATCH_SIZE"] = int(os.getenv("MINECRAFT_AUTH_CODE_SWEEP_BATCH_SIZE", "1000"))
+
+# Audit log, 0 writes every entry as soon as it's logged
+app.config["AUDIT_LOG_FLUSH_INTERVAL"] = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "2"))
+app.config["AUDIT_LOG_BATCH_SIZE"] = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "100"))
+app.config["AUDIT_LOG_MAX_BUFFERED"] = int(os.getenv("AUDIT_LOG_MAX_BUFFERED", "10000"))
+
+# Admin tables
+app.config["ADMIN_TABLE_COUNT_TIMEOUT"] = int(os.getenv("ADMIN_TABLE_COUNT_TIMEOUT", "60"))
+# Tables smaller than this are counted exactly instead of estimated
+app.config["ADMIN_TABLE_EXACT_COUNT_THRESHOLD"] = int(os.getenv("ADMIN_TABLE_EXACT_COUNT_THRESHOLD", "10000"))
 
 # Scheme settings
 if not os.getenv('ENVIRONMENT') == 'development':
@@ -100,9 +155,22 @@ else:
     app.config["PREFERRED_URL_SCHEME"] = "http"
 
 db.init_app(app)
+sql_profiler.init_app(app)
 migrate = Migrate(app, db)
 toolbar = DebugToolbarExtension(app)
 cache.init_app(app)
+instrument_cache(app, cache)
+invalidation_bus.init_app(app)
+init_session_cache(app)
+webhook_queue.init_app(app)
+audit_writer.init_app(app)
+presence.init_app(app)
+server_metrics.init_app(app)
+worker.init_app(app)
+worker.register("dispatch_commands", dispatch_due_commands, app.config["COMMAND_DISPATCH_INTERVAL"])
+worker.register("prune_server_statuses", prune_server_statuses, app.config["SERVER_STATUS_PRUNE_INTERVAL"])
+worker.register("prune_server_metrics", prune_server_metrics, app.config["SERVER_STATUS_PRUNE_INTERVAL"])
+worker.register("sweep_auth_codes", sweep_auth_codes, app.config["MINECRAFT_AUTH_CODE_SWEEP_INTERVAL"])
 
 
 # Blueprints
@@ -126,16 +194,15 @@ def load_user(user_id):
     # Check if user_id is a UUID
     if is_valid_uuid(user_id):
         # We wanna do some caching here to avoid hitting the database every time
-        unique_cache_key = "user_" + user_id
-        # This is pickling from our redis cache, this is safe to do since we're the ones handling it
-        # skipcq: BAN-B301
-        user_obj = pickle.loads(cache.get(unique_cache_key)) if cache.get(unique_cache_key) else None
-        if user_obj is None:
+        # This checks our process-local cache first, then redis
+        cached_user = get_cached_session(user_id)
+        if cached_user is None:
             query = User.query.filter_by(session_id=str(user_id)).first()
-            user_obj = pickle.dumps(query)
-            cache.set(unique_cache_key, user_obj, timeout=3600)
-            return query
-        return user_obj
+            session_user = SessionUser.from_user(query) if query else None
+            # An empty payload remembers that this session doesn't belong to anyone
+            set_cached_session(user_id, session_user.dumps() if session_user else b"")
+            return session_user
+        return SessionUser.loads(cached_user) if cached_user else None
     return None
 
 
@@ -304,7 +371,7 @@ def apply_post():
         db.session.add(application)
         db.session.commit()
         # Successful application submission, send a webhook
-        Thread(target=new_application, args=(application,)).start()
+        new_application(application)
         flash("Your application has been submitted!", "success")
         return redirect(url_for("user.profile"))
     else:
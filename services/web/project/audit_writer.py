@@ -0,0 +1,143 @@
+import atexit
+import threading
+import uuid
+from datetime import datetime as dt
+
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError, DataError
+
+from .models import db, AuditLog
+
+
+class AuditLogWriter:
+    """
+    Buffers audit log entries so the request that logs one doesn't wait on a commit.
+    The buffer is written with one multi-row insert once the flush interval has passed since
+    the first entry in it, or straight away once it holds a full batch. What's left is written
+    when the process shuts down. Entries the database rejects are dropped on their own, and
+    while it's unreachable up to max_buffered entries are kept and retried.
+    """
+
+    def __init__(self):
+        self.flush_interval = 2.0
+        self.batch_size = 100
+        self.max_buffered = 10000
+        self._app = None
+        self._buffer = []
+        self._timer = None
+        self._failing = False
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.flush_interval = app.config["AUDIT_LOG_FLUSH_INTERVAL"]
+        self.batch_size = app.config["AUDIT_LOG_BATCH_SIZE"]
+        self.max_buffered = app.config["AUDIT_LOG_MAX_BUFFERED"]
+        atexit.register(self.flush)
+
+    def write(self, user_id: int, action: str, target_id: int = 0, target_type: str = 'N/A'):
+        """
+        Queue an audit log entry
+        :param user_id: User that did it
+        :param action: What they did
+        :param target_id: ID of what they did it to
+        :param target_type: Type of what they did it to
+        """
+        # Same clock as the column's now() default and get_humanized_created_at
+        now = dt.now()
+        entry = {
+            "id": uuid.uuid4(),
+            "user_id": user_id,
+            "action": action,
+            "target_id": target_id,
+            "target_type": target_type,
+            # Taken now, the row may not be written for a little while
+            "created_at": now,
+            "updated_at": now
+        }
+        with self._lock:
+            self._buffer.append(entry)
+            self._trim()
+            # While the database is unreachable the timer retries, requests shouldn't wait on it too
+            full = not self._failing and (len(self._buffer) >= self.batch_size or self.flush_interval <= 0)
+            if not full:
+                self._schedule()
+        if full:
+            self.flush()
+
+    def _schedule(self):
+        # Call with self._lock held, retries after a failure wait at least a second
+        if self._timer is None:
+            delay = max(self.flush_interval, 1) if self._failing else self.flush_interval
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def flush(self):
+        """
+        Write everything in the buffer, a batch per statement
+        """
+        with self._flush_lock:
+            with self._lock:
+                entries = self._buffer
+                self._buffer = []
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            for start in range(0, len(entries), self.batch_size):
+                batch = entries[start:start + self.batch_size]
+                try:
+                    self._insert(batch)
+                except (IntegrityError, DataError):
+                    # Something in the batch can't be written, don't let it take the rest down with it
+                    left = self._insert_each(batch)
+                    if left:
+                        self._requeue(left + entries[start + self.batch_size:], None)
+                        return
+                except SQLAlchemyError as e:
+                    # Most likely the database is unreachable, keep everything that's left for the next flush
+                    self._requeue(entries[start:], e)
+                    return
+            self._failing = False
+
+    def _insert(self, entries):
+        # Its own connection, so a request's session is never committed from under it
+        with self._app.app_context(), db.engine.begin() as connection:
+            connection.execute(AuditLog.__table__.insert().values(entries))
+
+    def _insert_each(self, entries) -> list:
+        """
+        Write entries one at a time, dropping the ones the database rejects
+        :param entries: Entries to write
+
+        :return: Entries that weren't written for any other reason, to be retried
+        """
+        for i, entry in enumerate(entries):
+            try:
+                self._insert([entry])
+            except (IntegrityError, DataError) as e:
+                print(f"Dropping audit log entry {entry['action']!r} by user {entry['user_id']}: "
+                      f"{getattr(e, 'orig', e)}")
+            except SQLAlchemyError as e:
+                print(f"Failed to write audit log entries, will retry: {getattr(e, 'orig', e)}")
+                return entries[i:]
+        return []
+
+    def _requeue(self, entries, error):
+        if error is not None:
+            print(f"Failed to write {len(entries)} audit log entries, will retry: {getattr(error, 'orig', error)}")
+        with self._lock:
+            self._failing = True
+            self._buffer[:0] = entries
+            self._trim()
+            self._schedule()
+
+    def _trim(self):
+        # Call with self._lock held
+        overflow = len(self._buffer) - self.max_buffered
+        if overflow > 0:
+            del self._buffer[:overflow]
+            print(f"Audit log buffer is full, dropped the {overflow} oldest entries")
+
+
+audit_writer = AuditLogWriter()
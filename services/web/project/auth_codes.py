@@ -0,0 +1,97 @@
+import secrets
+from datetime import datetime as dt
+from datetime import timedelta
+
+from sqlalchemy.dialects.postgresql import insert
+
+from .extensions import app
+from .models import db, MinecraftAuthentication
+
+# Codes are 6 digits, the auth server shows them to players zero padded
+AUTH_CODE_SPACE = 1000000
+
+
+def get_auth_code_cutoff() -> dt:
+    # Codes created before this have expired
+    return dt.utcnow() - timedelta(hours=app.config["MINECRAFT_AUTH_CODE_TTL_HOURS"])
+
+
+def is_live():
+    """
+    Filter for auth codes that haven't expired yet, for lookups between sweeps
+    """
+    return MinecraftAuthentication.created_at >= get_auth_code_cutoff()
+
+
+def sweep_auth_codes():
+    """
+    Delete expired auth codes a batch at a time
+    """
+    cutoff = get_auth_code_cutoff()
+    batch_size = app.config["MINECRAFT_AUTH_CODE_SWEEP_BATCH_SIZE"]
+    deleted = 0
+    while True:
+        batch = db.session.query(MinecraftAuthentication.id).filter(
+            MinecraftAuthentication.created_at < cutoff
+        ).limit(batch_size).subquery()
+        count = MinecraftAuthentication.query.filter(
+            MinecraftAuthentication.id.in_(db.select(batch.c.id))
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            break
+    if deleted:
+        print(f"Swept {deleted} expired auth codes")
+
+
+def reserve_auth_codes(count: int, max_rounds: int = 5) -> list:
+    """
+    Reserve a batch of unused auth codes for the auth server to hand out.
+    The unique index on auth_code settles collisions, so every returned code is unique.
+    :param count: How many codes to reserve
+    :param max_rounds: How many times to top up after collisions before giving up
+
+    :return: The reserved codes, possibly fewer than asked for if the code space is crowded
+    """
+    reserved = []
+    for _ in range(max_rounds):
+        missing = count - len(reserved)
+        if missing <= 0:
+            break
+        candidates = {secrets.randbelow(AUTH_CODE_SPACE) for _ in range(missing)}
+        statement = insert(MinecraftAuthentication.__table__).values(
+            [{"auth_code": code, "is_used": False} for code in candidates]
+        ).on_conflict_do_nothing(index_elements=["auth_code"]).returning(MinecraftAuthentication.auth_code)
+        reserved.extend(row[0] for row in db.session.execute(statement))
+    db.session.commit()
+    return reserved
+
+
+def bind_auth_code(auth_code: int, uuid: str, username: str) -> bool:
+    """
+    Tie a reserved auth code to the player it was handed to
+    :param auth_code: Code the auth server gave the player
+    :param uuid: The player's Minecraft UUID
+    :param username: The player's Minecraft username
+
+    :return: True if the code was reserved and is now bound, False if it's unknown or already bound
+    """
+    bound = MinecraftAuthentication.query.filter(
+        MinecraftAuthentication.auth_code == auth_code,
+        MinecraftAuthentication.uuid.is_(None)
+    ).update({
+        "uuid": uuid,
+        "username": username,
+        # Expiry counts from when the player got the code, not from when it was reserved
+        "created_at": db.func.now()
+    }, synchronize_session=False)
+    if bound:
+        # The player was just shown this code, so any older one they never used is dead
+        MinecraftAuthentication.query.filter(
+            MinecraftAuthentication.uuid == uuid,
+            MinecraftAuthentication.is_used.is_(False),
+            MinecraftAuthentication.auth_code != auth_code
+        ).delete(synchronize_session=False)
+    db.session.commit()
+    return bool(bound)
@@ -1,14 +1,24 @@
+import os
+from datetime import datetime as dt
+from datetime import timedelta
+
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from sqlalchemy.exc import SQLAlchemyError
 
+from ..cache_stats import cache_stats
+from ..dashboard_stats import get_funnel_counts, get_membership_counts
+from ..datatables import paginate
 from ..decorators import admin_required
 from ..extensions import cache
 from ..logger import log_dev_status, log_staff_status, log_options_change
-from ..models import User, db, Ticket, TicketDepartment, SystemSetting, Faction, Application, AuditLog, ServerStatus, \
+from ..models import User, db, Ticket, TicketDepartment, SystemSetting, Faction, Application, AuditLog, \
     Class, Race
-from ..settings_helper import set_applications_status, set_site_theme, set_panel_settings, set_server_settings, \
-    get_server_settings, set_can_register, set_application_settings, set_join_discord, set_webhook_settings
+from ..server_metrics import server_metrics
+from ..server_status import get_latest_server_status
+from ..session_cache import local_sessions
+from ..settings_helper import get_server_settings, update_settings
+from ..sql_profiler import sql_profiler
 from ..webhooks import user_edited_by_admin, site_settings_hook
 
 admin_bp = Blueprint('admin', __name__)
@@ -26,37 +36,24 @@ def before_request():
 @cache.cached(timeout=1)
 def index():
     factions = Faction.query.order_by(Faction.id.desc()).all()
-    pending = Application.query.filter(db.and_(
-        Application.is_accepted.is_(False),
-        Application.is_rejected.is_(False)
-    )).count()
-    accepted = Application.query.filter(Application.is_accepted.is_(True)).count()
-    rejected = Application.query.filter(Application.is_rejected.is_(True)).count()
-    new_users = User.query.filter(db.and_(
-        User.discord_uuid.is_(None),
-        User.minecraft_uuid.is_(None)
-    )).count()
-    fully_authed = User.query.filter(db.and_(
-        User.discord_uuid.is_not(None),
-        User.minecraft_uuid.is_not(None),
-        User.is_whitelisted.is_(False)
-    )).count()
-    whitelisted = User.query.filter(User.is_whitelisted.is_(True)).count()
+    counts = get_funnel_counts()
+    membership_counts = get_membership_counts()
     servers = get_server_settings()
-    server_status = ServerStatus.query.order_by(ServerStatus.created_at.desc()).first()
-    status_json = server_status.status_json if server_status else None
+    server_status = get_latest_server_status()
+    status_json = server_status["status_json"] if server_status else None
     return render_template(
         'admin/index.html',
         title='Dashboard',
         factions=factions,
-        pending_count=pending,
-        accepted_count=accepted,
-        rejected_count=rejected,
-        new_users_count=new_users,
-        fully_authed_count=fully_authed,
-        whitelisted_count=whitelisted,
+        pending_count=counts["pending"],
+        accepted_count=counts["accepted"],
+        rejected_count=counts["rejected"],
+        new_users_count=counts["new_users"],
+        fully_authed_count=counts["fully_authed"],
+        whitelisted_count=counts["whitelisted"],
         servers=servers,
         status_json=status_json,
+        membership_counts=membership_counts,
         len=len
     )
 
@@ -145,23 +142,12 @@ def users_data():
             User.email.like(f'%{search}%')
         ))
 
-    total_filtered = query.count()
-
-    # order by id
-    query = query.order_by(User.id.desc())
-
-    # pagination
-    start = request.args.get('start', type=int)
-    length = request.args.get('length', type=int)
-    query = query.offset(start).limit(length)
+    # newest first, seeking from the neighbouring page where we can
+    page = paginate(query, User, search)
 
     # resp
-    return jsonify({
-        'data': [user.to_dict() for user in query.all()],
-        'recordsFiltered': total_filtered,
-        'recordsTotal': User.query.count(),
-        'draw': request.args.get('draw', type=int)
-    })
+    page['data'] = [user.to_dict() for user in page.pop('rows')]
+    return jsonify(page)
 
 
 @admin_bp.route('/tickets')
@@ -207,7 +193,7 @@ def manage_options():
     classes = Class.query.order_by(Class.id.asc()).all()
     races = Race.query.order_by(Race.id.asc()).all()
     return render_template("admin/manage_options.html", title="Manage Options", factions=factions, classes=classes,
-                           races=races)
+                           races=races, membership_counts=get_membership_counts())
 
 
 @admin_bp.route('/settings', methods=['GET'])
@@ -224,36 +210,35 @@ def settings():
 
 @admin_bp.route('/settings', methods=['POST'])
 def settings_post():
-    # Site settings section
-    set_site_theme(request.form.get('siteTheme'))
-    set_join_discord(request.form.get('join_discord_on_register') == 'on')
-    set_can_register(request.form.get('can_register') == 'on')
-
-    # Servers settings section
-    set_panel_settings(request.form.get('api_key'), request.form.get('api_url'))
-    set_server_settings(
-        request.form.get('live_server_uuid'),
-        request.form.get('staging_server_uuid'),
-        request.form.get('fallback_server_uuid')
-    )
-
-    # Application settings section
-    set_applications_status(request.form.get('applications_open') == 'on')
-    set_application_settings(
-        int(request.form.get('application_min_length')),
-        int(request.form.get('application_max_length'))
-    )
-
-    # Webhook settings section
-    set_webhook_settings(
-        request.form.get("ticket_webhook"),
-        request.form.get("application_webhook"),
-        request.form.get("general_webhook"),
-        request.form.get("dev_webhook")
-    )
-
+    changes = {
+        # Site settings section
+        'site_theme': request.form.get('siteTheme'),
+        'join_discord_on_register': request.form.get('join_discord_on_register') == 'on',
+        'can_register': request.form.get('can_register') == 'on',
+
+        # Servers settings section
+        'panel_api_key': request.form.get('api_key'),
+        'panel_api_url': request.form.get('api_url'),
+        'live_server_uuid': request.form.get('live_server_uuid'),
+        'staging_server_uuid': request.form.get('staging_server_uuid'),
+        'fallback_server_uuid': request.form.get('fallback_server_uuid'),
+
+        # Application settings section
+        'applications_open': request.form.get('applications_open') == 'on',
+        'minimum_length': int(request.form.get('application_min_length')),
+        'maximum_length': int(request.form.get('application_max_length')),
+
+        # Webhook settings section
+        'ticket_webhook': request.form.get("ticket_webhook"),
+        'application_webhook': request.form.get("application_webhook"),
+        'general_webhook': request.form.get("general_webhook"),
+        'dev_webhook': request.form.get("dev_webhook")
+    }
+
+    # Everything goes out in a single transaction, and only a real change is worth a webhook
+    if update_settings(changes):
+        site_settings_hook(current_user)
     flash('Settings updated', 'success')
-    site_settings_hook(current_user)
     return redirect(url_for('admin.settings'))
 
 
@@ -295,8 +280,8 @@ def audit_logs():
 
 @admin_bp.route('/audit-logs/data')
 def audit_logs_data():
-    # DataTables data stuff
-    query = AuditLog.query
+    # DataTables data stuff, the users are joined in so listing them doesn't cost a query per row
+    query = AuditLog.query.options(db.joinedload(AuditLog.user).load_only(User.id, User.username))
 
     # search filter
     search = request.args.get('search[value]')
@@ -307,25 +292,67 @@ def audit_logs_data():
             AuditLog.action.like(f'%{search}%'),
         ))
 
-    total_filtered = query.count()
-
-    # order by date
-    query = query.order_by(AuditLog.created_at.desc())
-
-    # pagination
-    start = request.args.get('start', type=int)
-    length = request.args.get('length', type=int)
-    query = query.offset(start).limit(length)
+    # order by date, seeking from the neighbouring page where we can
+    page = paginate(query, AuditLog, search)
 
     # resp
+    rows = page.pop('rows')
+    page['data'] = [row.to_row() for row in rows]
+    page['users'] = {row.user_id: {'username': row.user.username} for row in rows}
+    return jsonify(page)
+
+
+@admin_bp.route('/server_metrics/data', methods=['GET'])
+def server_metrics_data():
+    resolution = request.args.get('resolution', 'hour')
+    hours = request.args.get('hours', 24 * 14, type=int)
+    if resolution not in ('raw', 'minute', 'hour'):
+        return jsonify({"msg": "Resolution must be raw, minute or hour"}), 400
+    since = dt.utcnow() - timedelta(hours=hours)
+    series = {}
+    for server in get_server_settings().values():
+        if server['uuid'] == 'CHANGE_ME':
+            continue
+        if resolution == 'raw':
+            data = server_metrics.get_recent(server['uuid'], since)
+        else:
+            data = server_metrics.get_series(server['uuid'], resolution, since)
+        series[server['uuid']] = {"name": server['name'], "data": data}
+    return jsonify({"resolution": resolution, "series": series})
+
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+def cache_stats_data():
+    # These are per worker, so the pid is included to tell them apart
+    stats = cache_stats.snapshot()
+    stats['local'] = {
+        'sessions': local_sessions.stats()
+    }
+    return jsonify(stats)
+
+
+@admin_bp.route('/cache/stats/reset', methods=['POST'])
+def reset_cache_stats():
+    cache_stats.reset()
+    return jsonify({'success': True})
+
+
+@admin_bp.route('/sql/profile', methods=['GET'])
+def sql_profile_data():
+    # Requests with lots of statements, slow queries or N+1 suspects, per worker
     return jsonify({
-        'data': [row.to_dict() for row in query.all()],
-        'recordsFiltered': total_filtered,
-        'recordsTotal': AuditLog.query.count(),
-        'draw': request.args.get('draw', type=int)
+        'pid': os.getpid(),
+        'endpoints': sql_profiler.worst_endpoints(),
+        'requests': sql_profiler.worst_requests()
     })
 
 
+@admin_bp.route('/sql/profile/reset', methods=['POST'])
+def reset_sql_profile():
+    sql_profiler.clear()
+    return jsonify({'success': True})
+
+
 @admin_bp.route('/faction/new', methods=['POST'])
 def new_faction():
     name = request.form.get('factionName')
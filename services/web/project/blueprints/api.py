@@ -1,20 +1,22 @@
-import time
 from datetime import datetime as dt
 from datetime import timedelta
-from threading import Thread
 
-from flask import Blueprint, jsonify, request, flash, redirect, url_for, copy_current_request_context
+from flask import Blueprint, jsonify, request, flash, redirect, url_for
 from flask_login import login_required, current_user
 from sqlalchemy.exc import SQLAlchemyError
 
+from ..auth_codes import reserve_auth_codes, bind_auth_code, is_live
+from ..command_dispatcher import schedule_commands_for_user
 from ..decorators import staff_required, admin_required, auth_key_required
 from ..extensions import cache
 from ..helpers import get_username_from_uuid, MojangAPIError
-from ..helpers import send_template_to_email, send_command_to_server
+from ..helpers import send_template_to_email
 from ..logger import log_connect
 from ..models import MinecraftAuthentication, db, DiscordAuthentication, User, \
     Ticket, TicketReply, TicketDepartment, Application, Character, CommandQueue, \
-    ServerStatus, Faction
+    Faction
+from ..server_metrics import server_metrics
+from ..server_status import record_server_status
 from ..webhooks import new_ticket_reply, player_connected_hook
 
 api = Blueprint('api', __name__)
@@ -79,9 +81,17 @@ def auth_minecraft():
     # Ensure all data is present
     if not uuid or not username or not auth_code:
         return jsonify({"msg": "Missing data in request"}), 400
+    try:
+        auth_code = int(auth_code)
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Auth code must be a number"}), 400
+
+    # Codes from the auth server's pool were reserved up front and only need binding to the player
+    if bind_auth_code(auth_code, uuid, username):
+        return jsonify({"msg": "Auth code bound"}), 200
 
     # Check if the uuid already exists
-    uuid_search = MinecraftAuthentication.query.filter_by(uuid=uuid, is_used=False).first()
+    uuid_search = MinecraftAuthentication.query.filter_by(uuid=uuid, is_used=False).filter(is_live()).first()
     if uuid_search:
         return jsonify({"msg": "UUID already exists", "auth_code": uuid_search.auth_code}), 400
 
@@ -105,6 +115,24 @@ def auth_minecraft():
         return jsonify({"msg": "Auth code added"}), 200
 
 
+@api.route('/auth/minecraft/codes', methods=['POST'])
+@auth_key_required
+def reserve_minecraft_auth_codes():
+    """
+    Hands the auth server a batch of unique auth codes it can give out without asking us first.
+    :return: The reserved codes
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 50))
+    except (TypeError, ValueError):
+        return jsonify({"msg": "Count must be a number"}), 400
+    if not 1 <= count <= 500:
+        return jsonify({"msg": "Count must be between 1 and 500"}), 400
+    codes = reserve_auth_codes(count)
+    return jsonify({"msg": "Auth codes reserved", "codes": codes}), 200
+
+
 @api.route('/auth/discord', methods=['POST'])
 @auth_key_required
 def auth_discord():
@@ -256,10 +284,11 @@ def ticket_reply(ticket_id):
     else:
         ticket.status = 'replied'
         ticket.last_replied_at = dt.utcnow()
-        # Client replied to ticket, send webhook
-        Thread(target=new_ticket_reply, args=(ticket, reply_content)).start()
 
     db.session.commit()
+    if ticket.status == 'replied':
+        # Client replied to ticket, send webhook
+        new_ticket_reply(ticket, reply_content)
     flash('Reply added', 'success')
     # Return them to the page they were on
     if request.referrer:
@@ -474,22 +503,9 @@ def allow_connection(uuid):
             print(f"User {user.username} is whitelisted and has a character. Allowing connection.")
             log_connect(user)
 
-            @copy_current_request_context
-            def check_command_queue(user_id):
-                # Wait 30 seconds to ensure the user has properly connected
-                time.sleep(30)
-                # We need app context to do a query here
-                commands = CommandQueue.query.filter_by(user_id=user_id).all()
-
-                for command in commands:
-                    success = send_command_to_server("staging_server_uuid", command.command)
-                    if success:
-                        # Remove command
-                        db.session.delete(command)
-                        db.session.commit()
-
-            Thread(target=check_command_queue, args=(user.id,)).start()
-            Thread(target=player_connected_hook, args=(user,)).start()
+            # The dispatcher sends their queued commands once they've had time to properly connect
+            schedule_commands_for_user(user.id)
+            player_connected_hook(user)
             return jsonify({"allow": True}), 200
         else:
             return jsonify({"allow": False, "msg": "You need to make a character on your profile."}), 200
@@ -555,12 +571,24 @@ def delete_command(user_id, command_id):
 def update_server_status():
     # Get the JSON body from the request
     data = request.get_json()
-    status_obj = ServerStatus(data)
-    db.session.add(status_obj)
-    db.session.commit()
+    record_server_status(data)
     return jsonify({"msg": "Server status updated", "data": data}), 200
 
 
+@api.route('/server_metrics', methods=['POST'])
+@auth_key_required
+def record_server_metrics():
+    data = request.get_json()
+    if not isinstance(data, dict):
+        return jsonify({"msg": "Expected an object of server metrics"}), 400
+    for server_uuid, metrics in data.items():
+        try:
+            server_metrics.record(server_uuid, int(metrics.get("players", 0)), metrics.get("cpu"), metrics.get("memory"))
+        except (TypeError, ValueError, AttributeError):
+            return jsonify({"msg": f"Invalid metrics for server {server_uuid}"}), 400
+    return jsonify({"msg": "Server metrics recorded"}), 200
+
+
 @api.route('/get_faction_info/<int:faction_id>', methods=['GET'])
 def get_faction_info(faction_id):
     faction = Faction.query.filter_by(id=faction_id).first()
@@ -10,10 +10,11 @@ from sqlalchemy import func
 from sqlalchemy.exc import SQLAlchemyError
 from werkzeug.security import generate_password_hash, check_password_hash
 
+from ..auth_codes import is_live
 from ..decorators import minecraft_authenticated
-from ..extensions import cache
 from ..logger import log_login
 from ..models import User, db, EmailConfirmation, MinecraftAuthentication
+from ..session_cache import invalidate_session
 from ..settings_helper import get_site_settings
 from ..webhooks import new_user, email_confirmed_hook, discord_linked_hook, minecraft_linked_hook
 
@@ -199,8 +200,7 @@ def login_post():
 @login_required
 def logout():
     # Remove user from cache
-    cache_key = f"user_{current_user.session_id}"
-    cache.delete(cache_key)
+    invalidate_session(current_user.session_id)
     logout_user()
     flash('Logged out', "success")
     return redirect(url_for('index'))
@@ -328,7 +328,13 @@ def minecraft_authentication_post():
         return redirect(url_for('auth.minecraft_authentication'))
 
     # Look up the auth code entered
-    auth_code_object = MinecraftAuthentication.query.filter_by(auth_code=auth_code, is_used=False).first()
+    auth_code_object = MinecraftAuthentication.query.filter(
+        MinecraftAuthentication.auth_code == auth_code,
+        MinecraftAuthentication.is_used.is_(False),
+        # Reserved codes that haven't been handed to a player yet can't be redeemed
+        MinecraftAuthentication.uuid.is_not(None),
+        is_live()
+    ).first()
     if not auth_code_object:
         flash('Invalid auth code', "danger")
         return redirect(url_for('auth.minecraft_authentication'))
@@ -1,6 +1,5 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_required, current_user
-from threading import Thread
 
 from ..decorators import whitelist_required
 from ..models import db, Ticket, TicketReply, TicketDepartment
@@ -67,12 +66,12 @@ def create_post():
     db.session.add(ticket)
     db.session.commit()
 
-    # Send our webhook, do it in a thread so the ticket isn't blocked if an error occurs
-    Thread(target=new_ticket_webhook, args=(ticket.id, message)).start()
-
     # Add the message
     ticket_reply = TicketReply(ticket=ticket, content=message, user=current_user)
     db.session.add(ticket_reply)
     db.session.commit()
+
+    # Send our webhook, it's only queued so the ticket isn't blocked if an error occurs
+    new_ticket_webhook(ticket.id, message)
     flash('Ticket created', 'success')
     return redirect(url_for('ticket.mine'))
@@ -0,0 +1,221 @@
+import os
+import pickle
+import re
+import threading
+import time
+
+from flask import has_request_context, request
+
+MEMVER_SUFFIX = "_memver"
+# Anything past this many distinct prefixes gets lumped into "other" so stats can't grow unbounded
+MAX_PREFIXES = 200
+
+_TRAILING_ID = re.compile(r"[_:/-]?(?:[0-9a-fA-F-]{8,}|\d+)$")
+_PREFIX_CHARS = re.compile(r"^[A-Za-z0-9_:./-]+$")
+# base64 of the hashed arguments followed by the version data
+_MEMOIZED_KEY = re.compile(r"^[A-Za-z0-9+/=]{24,}$")
+
+# The key of a memoized call is an opaque hash, flask-caching always looks up the
+# function's version keys right before it though, so we remember which function that was
+_memoize_context = threading.local()
+
+
+def get_key_prefix(key: str) -> str:
+    """
+    Work out which bucket a cache key belongs to
+    :param key: Cache key as given to the cache
+
+    :return: Prefix the key's stats are recorded under
+    """
+    if key.startswith("view/"):
+        if has_request_context() and request.endpoint:
+            return f"view:{request.endpoint}"
+        return "view"
+    if key.endswith(MEMVER_SUFFIX):
+        # Drop the instance token, e.g. "project.models.User.has_character.<User admin 1>_memver"
+        name = key[:-len(MEMVER_SUFFIX)].split(".<")[0]
+        _memoize_context.name = name
+        return f"memoize:{name}/version"
+    memoized_name = getattr(_memoize_context, "name", None)
+    if memoized_name and _MEMOIZED_KEY.match(key):
+        return f"memoize:{memoized_name}"
+    prefix = _TRAILING_ID.sub("", key)
+    if not _PREFIX_CHARS.match(prefix):
+        return "other"
+    return prefix
+
+
+class CacheStats:
+    """
+    Per key prefix counters for cache traffic in this worker process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._prefixes = {}
+        self.started_at = time.time()
+
+    def _bucket(self, prefix):
+        bucket = self._prefixes.get(prefix)
+        if bucket is None:
+            if len(self._prefixes) >= MAX_PREFIXES:
+                prefix = "other"
+                bucket = self._prefixes.get(prefix)
+            if bucket is None:
+                bucket = {
+                    "hits": 0,
+                    "misses": 0,
+                    "sets": 0,
+                    "set_bytes": 0,
+                    "deletes": 0,
+                    "calls": 0,
+                    "latency_total_ms": 0.0,
+                    "latency_max_ms": 0.0
+                }
+                self._prefixes[prefix] = bucket
+        return bucket
+
+    def _record_latency(self, bucket, elapsed):
+        elapsed_ms = elapsed * 1000
+        bucket["calls"] += 1
+        bucket["latency_total_ms"] += elapsed_ms
+        if elapsed_ms > bucket["latency_max_ms"]:
+            bucket["latency_max_ms"] = elapsed_ms
+
+    def record_get(self, key, hit, elapsed):
+        with self._lock:
+            bucket = self._bucket(get_key_prefix(key))
+            bucket["hits" if hit else "misses"] += 1
+            self._record_latency(bucket, elapsed)
+
+    def record_set(self, key, size, elapsed):
+        with self._lock:
+            bucket = self._bucket(get_key_prefix(key))
+            bucket["sets"] += 1
+            bucket["set_bytes"] += size
+            self._record_latency(bucket, elapsed)
+
+    def record_delete(self, key, elapsed):
+        with self._lock:
+            bucket = self._bucket(get_key_prefix(key))
+            bucket["deletes"] += 1
+            self._record_latency(bucket, elapsed)
+
+    def reset(self):
+        with self._lock:
+            self._prefixes = {}
+            self.started_at = time.time()
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            prefixes = {}
+            for prefix, bucket in self._prefixes.items():
+                lookups = bucket["hits"] + bucket["misses"]
+                prefixes[prefix] = dict(
+                    bucket,
+                    hit_rate=round(bucket["hits"] / lookups, 4) if lookups else None,
+                    avg_set_bytes=round(bucket["set_bytes"] / bucket["sets"]) if bucket["sets"] else None,
+                    latency_avg_ms=round(bucket["latency_total_ms"] / bucket["calls"], 3) if bucket["calls"] else None
+                )
+            return {
+                "pid": os.getpid(),
+                "since": self.started_at,
+                "prefixes": prefixes
+            }
+
+
+def get_value_size(value) -> int:
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    try:
+        return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+    except (pickle.PicklingError, TypeError, AttributeError):
+        return 0
+
+
+class InstrumentedCache:
+    """
+    Wraps a flask-caching backend and records every call in a CacheStats.
+    @cache.cached and @cache.memoize talk to the backend directly, so this is
+    swapped in for the backend rather than wrapping the Cache object.
+    """
+
+    def __init__(self, backend, stats: CacheStats):
+        self._backend = backend
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._backend, name)
+
+    def get(self, key):
+        start = time.perf_counter()
+        rv = self._backend.get(key)
+        self._stats.record_get(key, rv is not None, time.perf_counter() - start)
+        return rv
+
+    def has(self, key):
+        start = time.perf_counter()
+        rv = self._backend.has(key)
+        self._stats.record_get(key, rv, time.perf_counter() - start)
+        return rv
+
+    def get_many(self, *keys):
+        start = time.perf_counter()
+        rv = self._backend.get_many(*keys)
+        elapsed = (time.perf_counter() - start) / max(len(keys), 1)
+        for key, value in zip(keys, rv):
+            self._stats.record_get(key, value is not None, elapsed)
+        return rv
+
+    def get_dict(self, *keys):
+        return dict(zip(keys, self.get_many(*keys)))
+
+    def set(self, key, value, timeout=None):
+        start = time.perf_counter()
+        rv = self._backend.set(key, value, timeout=timeout)
+        self._stats.record_set(key, get_value_size(value), time.perf_counter() - start)
+        return rv
+
+    def add(self, key, value, timeout=None):
+        start = time.perf_counter()
+        rv = self._backend.add(key, value, timeout=timeout)
+        self._stats.record_set(key, get_value_size(value), time.perf_counter() - start)
+        return rv
+
+    def set_many(self, mapping, timeout=None):
+        start = time.perf_counter()
+        rv = self._backend.set_many(mapping, timeout=timeout)
+        elapsed = (time.perf_counter() - start) / max(len(mapping), 1)
+        for key, value in mapping.items():
+            self._stats.record_set(key, get_value_size(value), elapsed)
+        return rv
+
+    def delete(self, key):
+        start = time.perf_counter()
+        rv = self._backend.delete(key)
+        self._stats.record_delete(key, time.perf_counter() - start)
+        return rv
+
+    def delete_many(self, *keys):
+        start = time.perf_counter()
+        rv = self._backend.delete_many(*keys)
+        elapsed = (time.perf_counter() - start) / max(len(keys), 1)
+        for key in keys:
+            self._stats.record_delete(key, elapsed)
+        return rv
+
+
+cache_stats = CacheStats()
+
+
+def instrument_cache(app, cache):
+    """
+    Swap the backend of an initialised Cache for an instrumented one
+    :param app: Flask app the cache was initialised on
+    :param cache: flask-caching Cache object
+    """
+    if not app.config["CACHE_STATS_ENABLED"]:
+        return
+    backend = app.extensions["cache"][cache]
+    if not isinstance(backend, InstrumentedCache):
+        app.extensions["cache"][cache] = InstrumentedCache(backend, cache_stats)
@@ -0,0 +1,86 @@
+from datetime import datetime as dt
+from datetime import timedelta
+
+from .extensions import app
+from .helpers import send_command_to_server, PANEL_TIMEOUT
+from .models import db, CommandQueue
+
+# Queued commands only ever went to the staging server
+COMMAND_SERVER = "staging_server_uuid"
+
+
+def schedule_commands_for_user(user_id: int):
+    """
+    Make a user's queued commands due once they've had time to properly connect
+    :param user_id: The user that just connected
+    """
+    dispatch_after = dt.utcnow() + timedelta(seconds=app.config["COMMAND_DISPATCH_DELAY"])
+    CommandQueue.query.filter(
+        CommandQueue.user_id == user_id,
+        CommandQueue.dispatch_after.is_(None)
+    ).update({"dispatch_after": dispatch_after}, synchronize_session=False)
+    db.session.commit()
+
+
+def claim_due_commands(batch_size: int) -> list:
+    """
+    Claim a batch of due commands by pushing them past a lease, then commit so no row
+    stays locked while we talk to the panel. If we die before sending them, they're
+    picked up again once the lease runs out.
+    :param batch_size: Most commands to claim
+
+    :return: List of (id, command) tuples
+    """
+    now = dt.utcnow()
+    commands = db.session.query(CommandQueue.id, CommandQueue.command).filter(
+        CommandQueue.dispatch_after <= now
+    ).order_by(
+        CommandQueue.dispatch_after, CommandQueue.created_at
+    ).limit(batch_size).with_for_update(skip_locked=True).all()
+    if commands:
+        # Every request can take up to the panel timeout to connect and again to read
+        lease = timedelta(seconds=batch_size * 2 * PANEL_TIMEOUT + 60)
+        CommandQueue.query.filter(CommandQueue.id.in_([row.id for row in commands])).update(
+            {"dispatch_after": now + lease}, synchronize_session=False
+        )
+    db.session.commit()
+    return commands
+
+
+def dispatch_due_commands():
+    """
+    Send every command that's due, a batch at a time. Rows are claimed with SKIP LOCKED
+    so several dispatchers never send the same command twice.
+
+    :return: Seconds until the next command is due, or None if nothing is scheduled
+    """
+    batch_size = app.config["COMMAND_DISPATCH_BATCH_SIZE"]
+    while True:
+        commands = claim_due_commands(batch_size)
+        if not commands:
+            break
+
+        delivered = []
+        failed = []
+        for command_id, command in commands:
+            if send_command_to_server(COMMAND_SERVER, command):
+                delivered.append(command_id)
+            else:
+                failed.append(command_id)
+
+        if delivered:
+            CommandQueue.query.filter(CommandQueue.id.in_(delivered)).delete(synchronize_session=False)
+        if failed:
+            # Same as before, anything that didn't go through waits for the player's next connection
+            CommandQueue.query.filter(CommandQueue.id.in_(failed)).update(
+                {"dispatch_after": None}, synchronize_session=False
+            )
+        db.session.commit()
+        if len(commands) < batch_size:
+            break
+
+    next_due = db.session.query(db.func.min(CommandQueue.dispatch_after)).scalar()
+    db.session.commit()
+    if next_due is None:
+        return None
+    return max(0.0, (next_due - dt.utcnow()).total_seconds())
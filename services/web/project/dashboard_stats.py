@@ -0,0 +1,108 @@
+from sqlalchemy import event, inspect
+
+from .extensions import cache
+from .models import db, User, Application, Character
+
+FUNNEL_COUNTS_KEY = 'dashboard_funnel_counts'
+MEMBERSHIP_COUNTS_KEY = 'membership_counts'
+
+# Each cached stat and the columns it's computed from, a commit that changes any of them drops it
+TRACKED_COLUMNS = {
+    FUNNEL_COUNTS_KEY: {
+        User: ("discord_uuid", "minecraft_uuid", "is_whitelisted"),
+        Application: ("is_accepted", "is_rejected")
+    },
+    MEMBERSHIP_COUNTS_KEY: {
+        Character: ("faction_id", "clazz", "subrace", "is_permad", "is_active")
+    }
+}
+
+
+@cache.cached(timeout=3600, key_prefix=FUNNEL_COUNTS_KEY)
+def get_funnel_counts():
+    """
+    Count the applications and users at each step of the funnel in one query
+
+    :return: Dict of counts
+    """
+    applications = db.session.query(
+        db.func.count().filter(db.and_(
+            Application.is_accepted.is_(False),
+            Application.is_rejected.is_(False)
+        )).label("pending"),
+        db.func.count().filter(Application.is_accepted.is_(True)).label("accepted"),
+        db.func.count().filter(Application.is_rejected.is_(True)).label("rejected")
+    ).select_from(Application).subquery()
+    users = db.session.query(
+        db.func.count().filter(db.and_(
+            User.discord_uuid.is_(None),
+            User.minecraft_uuid.is_(None)
+        )).label("new_users"),
+        db.func.count().filter(db.and_(
+            User.discord_uuid.is_not(None),
+            User.minecraft_uuid.is_not(None),
+            User.is_whitelisted.is_(False)
+        )).label("fully_authed"),
+        db.func.count().filter(User.is_whitelisted.is_(True)).label("whitelisted")
+    ).select_from(User).subquery()
+    # Both sides are a single row, so joining them on true just puts them side by side
+    row = db.session.query(applications, users).select_from(applications).join(users, db.true()).one()
+    return dict(row._mapping)
+
+
+@cache.cached(timeout=3600, key_prefix=MEMBERSHIP_COUNTS_KEY)
+def get_membership_counts():
+    """
+    Count the active characters in every faction, class and race with one grouped query.
+    Factions count characters that aren't perma'd, classes and races count the ones that are.
+
+    :return: Dict of "factions", "classes" and "races", each mapping an id to its count
+    """
+    rows = db.session.query(
+        Character.faction_id, Character.clazz, Character.subrace, Character.is_permad, db.func.count()
+    ).filter(
+        Character.is_active.is_(True)
+    ).group_by(Character.faction_id, Character.clazz, Character.subrace, Character.is_permad).all()
+    counts = {"factions": {}, "classes": {}, "races": {}}
+    for faction_id, class_id, race_id, is_permad, count in rows:
+        if is_permad:
+            counts["classes"][class_id] = counts["classes"].get(class_id, 0) + count
+            counts["races"][race_id] = counts["races"].get(race_id, 0) + count
+        else:
+            counts["factions"][faction_id] = counts["factions"].get(faction_id, 0) + count
+    return counts
+
+
+def get_stale_keys(session) -> set:
+    stale = set()
+    for key, models in TRACKED_COLUMNS.items():
+        for obj in session.new | session.deleted:
+            if isinstance(obj, tuple(models)):
+                stale.add(key)
+        for obj in session.dirty:
+            columns = models.get(type(obj))
+            if columns is None:
+                continue
+            state = inspect(obj)
+            if any(state.attrs[column].history.has_changes() for column in columns):
+                stale.add(key)
+    return stale
+
+
+@event.listens_for(db.session, "before_flush")
+def _track_stale_stats(session, _flush_context, _instances):
+    stale = get_stale_keys(session)
+    if stale:
+        session.info.setdefault("stale_stats", set()).update(stale)
+
+
+@event.listens_for(db.session, "after_commit")
+def _drop_stale_stats(session):
+    stale = session.info.pop("stale_stats", None)
+    if stale:
+        cache.delete_many(*stale)
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_stale_stats(session):
+    session.info.pop("stale_stats", None)
@@ -0,0 +1,104 @@
+import hashlib
+from datetime import datetime as dt
+
+from flask import request
+
+from .extensions import app, cache
+from .models import db
+
+
+def make_cursor(row) -> str:
+    return f"{row.created_at.isoformat()}|{row.id}"
+
+
+def parse_cursor(cursor: str, model):
+    """
+    Turn a cursor back into the (created_at, id) it was made from
+    :param cursor: Cursor from a previous response
+    :param model: Model the cursor points into
+
+    :return: Tuple of created_at and id, or None if the cursor is invalid
+    """
+    created_at, _, row_id = cursor.partition("|")
+    try:
+        return dt.fromisoformat(created_at), model.id.type.python_type(row_id)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_exact_count(query, cache_key: str, refresh: bool = False) -> int:
+    count = None if refresh else cache.get(cache_key)
+    if count is None:
+        count = query.order_by(None).count()
+        cache.set(cache_key, count, timeout=app.config["ADMIN_TABLE_COUNT_TIMEOUT"])
+    return count
+
+
+def get_estimated_count(model) -> int:
+    """
+    Get the planner's estimate of how many rows a table has, small tables are counted exactly
+    :param model: Model of the table to count
+
+    :return: Number of rows
+    """
+    cache_key = f"table_count_{model.__tablename__}"
+    count = cache.get(cache_key)
+    if count is not None:
+        return count
+    estimate = None
+    if db.engine.dialect.name == "postgresql":
+        estimate = db.session.execute(
+            db.text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+            {"table": model.__tablename__}
+        ).scalar()
+    # Tables that have never been analyzed have no estimate yet
+    if estimate is None or estimate < app.config["ADMIN_TABLE_EXACT_COUNT_THRESHOLD"]:
+        return get_exact_count(model.query, cache_key, refresh=True)
+    cache.set(cache_key, estimate, timeout=app.config["ADMIN_TABLE_COUNT_TIMEOUT"])
+    return estimate
+
+
+def paginate(query, model, search: str = None) -> dict:
+    """
+    Get one page of a DataTables server-side table, newest first.
+    When the client passes the cursor of the page it's next to, the page is found with a seek on
+    (created_at, id) instead of an offset. Totals are estimated unless `exact` is passed.
+    :param query: Query with any search filters applied
+    :param model: Model being paged through, needs created_at and id
+    :param search: Search term the query was filtered by
+
+    :return: The DataTables response, without the rows serialized
+    """
+    start = request.args.get('start', 0, type=int)
+    length = request.args.get('length', 10, type=int)
+    exact = request.args.get('exact', 0, type=int) == 1
+    after = parse_cursor(request.args['after'], model) if request.args.get('after') else None
+    before = parse_cursor(request.args['before'], model) if request.args.get('before') else None
+
+    if exact:
+        total = get_exact_count(model.query, f"table_count_{model.__tablename__}", refresh=True)
+    else:
+        total = get_estimated_count(model)
+    if search:
+        search_hash = hashlib.sha1(search.encode()).hexdigest()
+        filtered = get_exact_count(query, f"table_count_{model.__tablename__}_{search_hash}", refresh=exact)
+    else:
+        filtered = total
+
+    key = db.tuple_(model.created_at, model.id)
+    if after:
+        rows = query.filter(key < after).order_by(model.created_at.desc(), model.id.desc()).limit(length).all()
+    elif before:
+        rows = query.filter(key > before).order_by(model.created_at.asc(), model.id.asc()).limit(length).all()
+        rows.reverse()
+    else:
+        rows = query.order_by(model.created_at.desc(), model.id.desc()).offset(start).limit(length).all()
+
+    return {
+        'rows': rows,
+        'recordsFiltered': filtered,
+        'recordsTotal': total,
+        'draw': request.args.get('draw', type=int),
+        'first_cursor': make_cursor(rows[0]) if rows else None,
+        'last_cursor': make_cursor(rows[-1]) if rows else None
+    }
@@ -1,5 +1,8 @@
 from flask_caching import Cache
 from flask import Flask
 
+from .local_cache import InvalidationBus
+
 cache = Cache()
+invalidation_bus = InvalidationBus()
 app = Flask(__name__)
@@ -7,6 +7,12 @@ from .models import User
 from .settings_helper import get_server_settings, get_site_settings
 
 MAILGUN_API_KEY = os.environ.get('MAILGUN_API_KEY')
+PANEL_TIMEOUT = float(os.environ.get('PANEL_TIMEOUT', '10'))
+
+# Shared by every panel call so connections to the panel are kept alive and reused
+panel_session = requests.Session()
+panel_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+panel_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
 
 
 class Error(Exception):
@@ -92,7 +98,7 @@ def is_server_online(server_uuid: str) -> bool:
 
     # We need to do a get request to the panel to get the server status
     url = f"{panel_settings['panel_api_url']}servers/{server_uuid}/resources"
-    r = requests.get(url, headers=headers)
+    r = panel_session.get(url, headers=headers, timeout=PANEL_TIMEOUT)
     if r.status_code == 200:
         # Get the JSON response
         try:
@@ -119,5 +125,9 @@ def send_command_to_server(server_name: str, command: str) -> bool:
 
     # We need to do a post request to the panel to send a command
     url = f"{panel_settings['panel_api_url']}servers/{server_uuid}/command"
-    r = requests.post(url, headers=headers, json={'command': command})
+    try:
+        r = panel_session.post(url, headers=headers, json={'command': command}, timeout=PANEL_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"Failed to send command to server {server_name}: {e}")
+        return False
     return r.status_code == 204
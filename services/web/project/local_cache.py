@@ -0,0 +1,175 @@
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+
+def get_redis_client(app):
+    """
+    Get a Redis client pointing at the same Redis as the cache
+    :param app: Flask app to read the cache config from
+
+    :return: Redis client, or None if the cache isn't backed by Redis
+    """
+    cache_type = str(app.config.get("CACHE_TYPE", ""))
+    if "redis" not in cache_type.lower():
+        return None
+    return redis.Redis.from_url(app.config["CACHE_REDIS_URL"])
+
+
+class LocalCache:
+    """
+    A small process-local LRU cache where every entry also expires after a TTL.
+    This sits in front of Redis for values that are read on (nearly) every request.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else None
+        }
+
+
+class VersionedSnapshot:
+    """
+    Holds one value in memory until a newer version of it is announced.
+    Announcing a version only marks the value stale, it's reloaded lazily on the next read.
+    """
+
+    def __init__(self):
+        self.version = None
+        self._value = None
+        self._stale = True
+        self._lock = threading.Lock()
+
+    def get(self, load):
+        """
+        Get the current value, reloading it if a new version was announced
+        :param load: Called to load the value when it's stale
+
+        :return: The value
+        """
+        if not self._stale:
+            return self._value
+        with self._lock:
+            if self._stale:
+                # Cleared before loading, so a version announced mid-load triggers another reload
+                self._stale = False
+                try:
+                    self._value = load()
+                except Exception:
+                    self._stale = True
+                    raise
+            return self._value
+
+    def advance(self, version):
+        # None means we may have missed an announcement, so always reload
+        if version is None or str(version) != str(self.version):
+            self.version = version
+            self._stale = True
+
+
+class InvalidationBus:
+    """
+    Broadcasts cache invalidations to every worker process over Redis pub/sub.
+    Handlers are registered per topic and are called with the published payload,
+    or with None when we may have missed messages and everything should be dropped.
+    When the cache isn't Redis backed there is only one process, so publishing just
+    calls the local handlers.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+        self._client = None
+        self._listener = None
+
+    def init_app(self, app):
+        self._client = get_redis_client(app)
+        if self._client is not None:
+            self._listener = threading.Thread(target=self._listen, daemon=True)
+            self._listener.start()
+
+    def subscribe(self, topic, handler):
+        self._handlers.setdefault(topic, []).append(handler)
+
+    def publish(self, topic, payload):
+        # Always invalidate our own process straight away, the message we get back from Redis is a no-op
+        self._dispatch(topic, payload)
+        if self._client is None:
+            return
+        try:
+            self._client.publish(INVALIDATION_CHANNEL, f"{topic}:{payload}")
+        except redis.exceptions.RedisError as e:
+            print(f"Failed to publish invalidation for {topic}: {e}")
+
+    def _dispatch(self, topic, payload):
+        for handler in self._handlers.get(topic, []):
+            handler(payload)
+
+    def _dispatch_all(self):
+        for topic in list(self._handlers):
+            self._dispatch(topic, None)
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Anything published while we weren't subscribed is lost, so start from a clean slate
+                self._dispatch_all()
+                for message in pubsub.listen():
+                    topic, _, payload = message["data"].decode().partition(":")
+                    self._dispatch(topic, payload)
+            except redis.exceptions.RedisError as e:
+                print(f"Lost connection to the invalidation channel: {e}")
+                self._dispatch_all()
+                time.sleep(5)
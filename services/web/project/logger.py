@@ -1,55 +1,43 @@
-from .models import AuditLog, db, User
+from .audit_writer import audit_writer
+from .models import User
 
+# Entries are buffered and written in batches, so they show up in the audit log a moment later
 
-def log_login(user: User) -> AuditLog:
-    log_entry = AuditLog(
+
+def log_login(user: User):
+    audit_writer.write(
         user_id=user.id,
         action="LOGIN"
     )
-    db.session.add(log_entry)
-    db.session.commit()
-    return log_entry
 
 
-def log_dev_status(user: User, status: bool, target: User) -> AuditLog:
-    log_entry = AuditLog(
+def log_dev_status(user: User, status: bool, target: User):
+    audit_writer.write(
         user_id=user.id,
         action=f"DEV_STATUS {status}",
         target_id=target.id,
         target_type="USER"
     )
-    db.session.add(log_entry)
-    db.session.commit()
-    return log_entry
 
 
-def log_staff_status(user: User, status: bool, target: User) -> AuditLog:
-    log_entry = AuditLog(
+def log_staff_status(user: User, status: bool, target: User):
+    audit_writer.write(
         user_id=user.id,
         action=f"STAFF_STATUS {status}",
         target_id=target.id,
         target_type="USER"
     )
-    db.session.add(log_entry)
-    db.session.commit()
-    return log_entry
 
 
-def log_connect(user: User) -> AuditLog:
-    log_entry = AuditLog(
+def log_connect(user: User):
+    audit_writer.write(
         user_id=user.id,
         action="CONNECT"
     )
-    db.session.add(log_entry)
-    db.session.commit()
-    return log_entry
 
 
-def log_options_change(user: User, option: str) -> AuditLog:
-    log_entry = AuditLog(
+def log_options_change(user: User, option: str):
+    audit_writer.write(
         user_id=user.id,
         action=option
     )
-    db.session.add(log_entry)
-    db.session.commit()
-    return log_entry
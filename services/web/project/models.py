@@ -11,12 +11,17 @@ from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.dialects.postgresql import UUID
 
 from .extensions import cache
+from .presence import presence
+from .session_cache import invalidate_session
 
 db = SQLAlchemy()
 
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
+    __table_args__ = (
+        db.Index('ix_users_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     session_id = db.Column(UUID(as_uuid=True), unique=True, nullable=False, default=uuid.uuid4)
@@ -119,7 +124,7 @@ class User(UserMixin, db.Model):
         return str(self.session_id)
 
     def delete_cache_for_user(self):
-        cache.delete(f"user_{self.session_id}")
+        invalidate_session(self.session_id)
 
     def commit_and_invalidate_cache(self):
         db.session.commit()
@@ -270,15 +275,19 @@ class Character(db.Model):
 
 class MinecraftAuthentication(db.Model):
     __tablename__ = 'minecraft_authentications'
+    __table_args__ = (
+        db.Index('ix_minecraft_authentications_uuid_is_used', 'uuid', 'is_used'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
-    auth_code = db.Column(db.Integer, nullable=False)
-    uuid = db.Column(db.String(255), nullable=False)
-    username = db.Column(db.String(255), nullable=False)
+    auth_code = db.Column(db.Integer, nullable=False, unique=True, index=True)
+    # Both are empty while the code is reserved by the auth server but not handed out yet
+    uuid = db.Column(db.String(255), nullable=True)
+    username = db.Column(db.String(255), nullable=True)
     is_used = db.Column(db.Boolean, nullable=False, default=False)
 
     # Timestamps
-    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), index=True)
     updated_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now())
 
     def __init__(self, auth_code, given_uuid, username):
@@ -492,19 +501,18 @@ class Faction(db.Model):
         return f'<Faction {self.id}>'
 
     def total(self):
-        # Get all characters that aren't perma'd
-        characters = Character.query.filter_by(faction_id=self.id).filter_by(is_permad=False).filter_by(is_active=True).all()
-        return len(characters)
+        # Active characters that aren't perma'd, looked up in the cached counts for every faction
+        from .dashboard_stats import get_membership_counts
+        return get_membership_counts()["factions"].get(self.id, 0)
 
     def online(self):
-        # TODO: Make this pull from the DB
-        _characters = self.characters
-        return "N/A"
+        # Counted from the presence index the server poller keeps up to date
+        online = presence.faction_online(self.id)
+        return "N/A" if online is None else online
 
     def offline(self):
-        # TODO: Make this pull from the DB
-        _characters = self.characters
-        return "N/A"
+        offline = presence.faction_offline(self.id)
+        return "N/A" if offline is None else offline
 
     def get_commands_as_list(self) -> [str]:
         if self.commands is None:
@@ -537,8 +545,8 @@ class Class(db.Model):
         return f'<Class {self.id}>'
 
     def total(self):
-        characters = Character.query.filter_by(clazz=self.id).filter_by(is_permad=True).filter_by(is_active=True).all()
-        return len(characters)
+        from .dashboard_stats import get_membership_counts
+        return get_membership_counts()["classes"].get(self.id, 0)
 
     def is_used(self):
         # Check if there is characters or applications using this class
@@ -578,8 +586,8 @@ class Race(db.Model):
         return f'<Race {self.id}'
 
     def total(self):
-        characters = Character.query.filter_by(subrace=self.id).filter_by(is_permad=True).filter_by(is_active=True).all()
-        return len(characters)
+        from .dashboard_stats import get_membership_counts
+        return get_membership_counts()["races"].get(self.id, 0)
 
     def is_used(self):
         # Check if there is characters or applications using this class
@@ -596,6 +604,9 @@ class Race(db.Model):
 
 class AuditLog(db.Model):
     __tablename__ = 'audit_logs'
+    __table_args__ = (
+        db.Index('ix_audit_logs_created_at_id', 'created_at', 'id'),
+    )
 
     id = db.Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
@@ -630,6 +641,17 @@ class AuditLog(db.Model):
             'updated_at': self.updated_at
         }
 
+    def to_row(self):
+        # Compact shape for the audit log table, the users are sent once per page alongside the rows
+        return {
+            'id': str(self.id),
+            'user_id': self.user_id,
+            'action': self.action,
+            'target_id': self.target_id,
+            'target_type': self.target_type,
+            'created_at_human': self.get_humanized_created_at()
+        }
+
     def get_humanized_created_at(self):
         return humanize.naturaltime(datetime.datetime.now() - self.created_at)
 
@@ -641,6 +663,8 @@ class CommandQueue(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     user = db.relationship('User', backref='commands', lazy='subquery')
     command = db.Column(db.Text(), nullable=False)
+    # When the dispatcher should send this, null until the player next connects
+    dispatch_after = db.Column(db.DateTime, nullable=True, index=True)
 
     # Timestamps
     created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
@@ -661,7 +685,7 @@ class ServerStatus(db.Model):
     status_json = db.Column(db.JSON, nullable=False)
 
     # Timestamps
-    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now())
+    created_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), index=True)
     updated_at = db.Column(db.DateTime, nullable=False, default=db.func.now(), onupdate=db.func.now())
 
     def __init__(self, status_json):
@@ -669,3 +693,28 @@ class ServerStatus(db.Model):
 
     def __repr__(self):
         return f'<ServerStatus {self.id}>'
+
+
+class ServerMetric(db.Model):
+    __tablename__ = 'server_metrics'
+    __table_args__ = (
+        db.UniqueConstraint('server_uuid', 'resolution', 'bucket', name='uq_server_metrics_bucket'),
+    )
+
+    id = db.Column(db.BigInteger, primary_key=True)
+    server_uuid = db.Column(db.String(36), nullable=False)
+    # Either "minute" or "hour"
+    resolution = db.Column(db.String(6), nullable=False)
+    bucket = db.Column(db.DateTime, nullable=False)
+    samples = db.Column(db.Integer, nullable=False, default=0)
+    players_sum = db.Column(db.Float, nullable=False, default=0)
+    players_max = db.Column(db.Integer, nullable=False, default=0)
+    # CPU and memory aren't reported while a server is offline, so they're counted separately
+    resource_samples = db.Column(db.Integer, nullable=False, default=0)
+    cpu_sum = db.Column(db.Float, nullable=False, default=0)
+    cpu_max = db.Column(db.Float, nullable=False, default=0)
+    memory_sum = db.Column(db.Float, nullable=False, default=0)
+    memory_max = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<ServerMetric {self.server_uuid} {self.resolution} {self.bucket}>'
@@ -0,0 +1,92 @@
+import threading
+import time
+
+import redis
+
+from .local_cache import get_redis_client
+
+PRESENCE_PREFIX = "presence"
+
+
+def get_server_key(server_uuid) -> str:
+    return f"{PRESENCE_PREFIX}:server:{server_uuid}"
+
+
+def get_faction_key(faction_id, kind: str) -> str:
+    return f"{PRESENCE_PREFIX}:faction:{faction_id}:{kind}"
+
+
+class PresenceIndex:
+    """
+    Who's online, kept as sets of Minecraft UUIDs per server and per faction.
+    Every faction also has a set of its members, so online and offline counts are just set sizes.
+    The sets live in Redis when the cache is Redis backed, otherwise in this process.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._sets = {}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._client = get_redis_client(app)
+
+    def replace(self, sets: dict):
+        """
+        Swap the whole index for a freshly built one
+        :param sets: Every presence key mapped to its set of Minecraft UUIDs
+        """
+        sets = dict(sets)
+        sets[f"{PRESENCE_PREFIX}:updated_at"] = {str(time.time())}
+        if self._client is None:
+            with self._lock:
+                self._sets = sets
+            return
+        try:
+            stale = set(key.decode() for key in self._client.scan_iter(f"{PRESENCE_PREFIX}:*")) - set(sets)
+            # One transaction, so readers never see a half built index
+            pipeline = self._client.pipeline(transaction=True)
+            for key in stale:
+                pipeline.delete(key)
+            for key, members in sets.items():
+                pipeline.delete(key)
+                if members:
+                    pipeline.sadd(key, *members)
+            pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Failed to update the presence index: {e}")
+
+    def count(self, key: str):
+        """
+        Get the size of one of the sets
+        :param key: Presence key
+
+        :return: Number of members, or None if the index hasn't been built yet
+        """
+        if self._client is None:
+            with self._lock:
+                if not self._sets:
+                    return None
+                return len(self._sets.get(key, ()))
+        try:
+            pipeline = self._client.pipeline(transaction=False)
+            pipeline.exists(f"{PRESENCE_PREFIX}:updated_at")
+            pipeline.scard(key)
+            built, size = pipeline.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Failed to read the presence index: {e}")
+            return None
+        return size if built else None
+
+    def faction_online(self, faction_id):
+        return self.count(get_faction_key(faction_id, "online"))
+
+    def faction_offline(self, faction_id):
+        members = self.count(get_faction_key(faction_id, "members"))
+        online = self.faction_online(faction_id)
+        if members is None or online is None:
+            return None
+        return max(members - online, 0)
+
+
+presence = PresenceIndex()
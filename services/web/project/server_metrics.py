@@ -0,0 +1,282 @@
+import atexit
+import threading
+from array import array
+from datetime import datetime as dt
+from datetime import timedelta
+from datetime import timezone
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import SQLAlchemyError
+
+from .extensions import app
+from .models import db, ServerMetric
+
+RESOLUTIONS = ("minute", "hour")
+AGGREGATE_FIELDS = ("samples", "players_sum", "players_max", "resource_samples", "cpu_sum", "cpu_max",
+                    "memory_sum", "memory_max")
+
+
+def to_timestamp(at: dt) -> float:
+    # Our datetimes are naive UTC, .timestamp() alone would treat them as local time
+    return at.replace(tzinfo=timezone.utc).timestamp()
+
+
+def get_bucket(at: dt, resolution: str) -> dt:
+    if resolution == "hour":
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(second=0, microsecond=0)
+
+
+def new_aggregate() -> dict:
+    return dict.fromkeys(AGGREGATE_FIELDS, 0)
+
+
+def add_sample(aggregate: dict, players: int, cpu, memory):
+    aggregate["samples"] += 1
+    aggregate["players_sum"] += players
+    aggregate["players_max"] = max(aggregate["players_max"], players)
+    if cpu is not None and memory is not None:
+        aggregate["resource_samples"] += 1
+        aggregate["cpu_sum"] += cpu
+        aggregate["cpu_max"] = max(aggregate["cpu_max"], cpu)
+        aggregate["memory_sum"] += memory
+        aggregate["memory_max"] = max(aggregate["memory_max"], memory)
+
+
+def merge_aggregates(into: dict, other: dict):
+    for field in AGGREGATE_FIELDS:
+        if field.endswith("_max"):
+            into[field] = max(into[field], other[field])
+        else:
+            into[field] += other[field]
+
+
+def summarise(bucket: dt, aggregate: dict) -> dict:
+    samples = aggregate["samples"] or 1
+    resource_samples = aggregate["resource_samples"]
+    return {
+        "bucket": bucket.isoformat(),
+        "players_avg": round(aggregate["players_sum"] / samples, 2),
+        "players_max": aggregate["players_max"],
+        "cpu_avg": round(aggregate["cpu_sum"] / resource_samples, 2) if resource_samples else None,
+        "cpu_max": aggregate["cpu_max"] if resource_samples else None,
+        "memory_avg": round(aggregate["memory_sum"] / resource_samples) if resource_samples else None,
+        "memory_max": aggregate["memory_max"] if resource_samples else None
+    }
+
+
+class RingBuffer:
+    """
+    The last `capacity` samples of one server, held in flat arrays.
+    Once it's full the oldest sample is overwritten.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.players = array("i", bytes(4 * capacity))
+        # NaN marks a sample without resource usage
+        self.cpu = array("d", bytes(8 * capacity))
+        self.memory = array("d", bytes(8 * capacity))
+        self._next = 0
+        self._size = 0
+
+    def append(self, timestamp: float, players: int, cpu, memory):
+        self.timestamps[self._next] = timestamp
+        self.players[self._next] = players
+        self.cpu[self._next] = float("nan") if cpu is None else cpu
+        self.memory[self._next] = float("nan") if memory is None else memory
+        self._next = (self._next + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def __len__(self):
+        return self._size
+
+    def samples(self, since: float = 0) -> list:
+        """
+        Get the buffered samples, oldest first
+        :param since: Only samples taken at or after this Unix timestamp
+
+        :return: List of (timestamp, players, cpu, memory) tuples
+        """
+        start = (self._next - self._size) % self.capacity
+        output = []
+        for offset in range(self._size):
+            i = (start + offset) % self.capacity
+            if self.timestamps[i] < since:
+                continue
+            cpu, memory = self.cpu[i], self.memory[i]
+            output.append((
+                self.timestamps[i],
+                self.players[i],
+                None if cpu != cpu else cpu,
+                None if memory != memory else memory
+            ))
+        return output
+
+
+class ServerMetricsStore:
+    """
+    Player count, CPU and memory history per server.
+    Recent raw samples are kept in a ring buffer per server. Every sample is also added to the
+    per-minute and per-hour rollups, which are upserted into server_metrics in one batch by a timer
+    that starts with the first pending sample, so they're written even if samples stop coming in.
+    Upserts add to what's already stored, so several processes can share a bucket. The raw buffers
+    only hold what this process was sent, the rollups are what every process sees.
+    """
+
+    def __init__(self):
+        self.capacity = 1440
+        self.flush_interval = 300
+        self._app = None
+        self._buffers = {}
+        self._pending = {}
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self._app = app
+        self.capacity = app.config["SERVER_METRICS_BUFFER_SIZE"]
+        self.flush_interval = app.config["SERVER_METRICS_FLUSH_INTERVAL"]
+
+        # Rollups that haven't been written yet would be lost otherwise
+        @atexit.register
+        def flush_on_exit():
+            with app.app_context():
+                self.flush()
+
+    def record(self, server_uuid: str, players: int, cpu=None, memory=None, at: dt = None):
+        """
+        Record one sample for a server
+        :param server_uuid: Server the sample is for
+        :param players: Number of players online
+        :param cpu: CPU usage, None if it wasn't reported
+        :param memory: Memory usage, None if it wasn't reported
+        :param at: When the sample was taken, defaults to now
+        """
+        at = at or dt.utcnow()
+        with self._lock:
+            buffer = self._buffers.get(server_uuid)
+            if buffer is None:
+                buffer = self._buffers[server_uuid] = RingBuffer(self.capacity)
+            buffer.append(to_timestamp(at), players, cpu, memory)
+            for resolution in RESOLUTIONS:
+                key = (server_uuid, resolution, get_bucket(at, resolution))
+                aggregate = self._pending.get(key)
+                if aggregate is None:
+                    aggregate = self._pending[key] = new_aggregate()
+                add_sample(aggregate, players, cpu, memory)
+            self._schedule()
+
+    def _schedule(self):
+        # Call with self._lock held
+        if self._timer is None and self._app is not None:
+            self._timer = threading.Timer(self.flush_interval, self._flush_on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def _flush_on_timer(self):
+        with self._app.app_context():
+            self.flush()
+
+    def flush(self):
+        """
+        Write the pending rollups to the database in one statement
+        """
+        with self._lock:
+            pending = self._pending
+            self._pending = {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not pending:
+            return
+        rows = [
+            dict(server_uuid=server_uuid, resolution=resolution, bucket=bucket, **aggregate)
+            for (server_uuid, resolution, bucket), aggregate in pending.items()
+        ]
+        statement = insert(ServerMetric.__table__).values(rows)
+        excluded = statement.excluded
+        table = ServerMetric.__table__.c
+        statement = statement.on_conflict_do_update(
+            index_elements=["server_uuid", "resolution", "bucket"],
+            set_={
+                field: db.func.greatest(table[field], excluded[field]) if field.endswith("_max")
+                else table[field] + excluded[field]
+                for field in AGGREGATE_FIELDS
+            }
+        )
+        try:
+            db.session.execute(statement)
+            db.session.commit()
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            print(f"Failed to write server metrics, will retry on the next flush: {getattr(e, 'orig', e)}")
+            with self._lock:
+                for key, aggregate in pending.items():
+                    if key in self._pending:
+                        merge_aggregates(self._pending[key], aggregate)
+                    else:
+                        self._pending[key] = aggregate
+                self._schedule()
+
+    def get_recent(self, server_uuid: str, since: dt) -> list:
+        """
+        Get the raw samples still held in memory for a server
+        :param server_uuid: Server to get samples for
+        :param since: Oldest sample to include
+
+        :return: List of samples, oldest first
+        """
+        with self._lock:
+            buffer = self._buffers.get(server_uuid)
+            samples = buffer.samples(to_timestamp(since)) if buffer else []
+        return [
+            {"at": dt.utcfromtimestamp(timestamp).isoformat(), "players": players, "cpu": cpu, "memory": memory}
+            for timestamp, players, cpu, memory in samples
+        ]
+
+    def get_series(self, server_uuid: str, resolution: str, since: dt) -> list:
+        """
+        Get the rolled up history of a server, including what hasn't been flushed yet
+        :param server_uuid: Server to get the history of
+        :param resolution: "minute" or "hour"
+        :param since: Oldest bucket to include
+
+        :return: List of buckets, oldest first
+        """
+        since = get_bucket(since, resolution)
+        buckets = {}
+        rows = ServerMetric.query.filter(
+            ServerMetric.server_uuid == server_uuid,
+            ServerMetric.resolution == resolution,
+            ServerMetric.bucket >= since
+        ).order_by(ServerMetric.bucket).all()
+        for row in rows:
+            buckets[row.bucket] = {field: getattr(row, field) for field in AGGREGATE_FIELDS}
+        with self._lock:
+            for (pending_uuid, pending_resolution, bucket), aggregate in self._pending.items():
+                if pending_uuid != server_uuid or pending_resolution != resolution or bucket < since:
+                    continue
+                if bucket in buckets:
+                    merge_aggregates(buckets[bucket], aggregate)
+                else:
+                    buckets[bucket] = dict(aggregate)
+        return [summarise(bucket, buckets[bucket]) for bucket in sorted(buckets)]
+
+
+def prune_server_metrics():
+    """
+    Delete rollups that are past their retention, minutes go long before hours do
+    """
+    now = dt.utcnow()
+    for resolution, days in (("minute", app.config["SERVER_METRICS_MINUTE_RETENTION_DAYS"]),
+                             ("hour", app.config["SERVER_METRICS_HOUR_RETENTION_DAYS"])):
+        ServerMetric.query.filter(
+            ServerMetric.resolution == resolution,
+            ServerMetric.bucket < now - timedelta(days=days)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+server_metrics = ServerMetricsStore()
@@ -0,0 +1,105 @@
+from datetime import datetime as dt
+from datetime import timedelta
+
+from .extensions import app, cache
+from .models import db, ServerStatus, Character, User, Faction
+from .presence import presence, get_server_key, get_faction_key
+
+LATEST_STATUS_KEY = "server_status_latest"
+
+
+def record_server_status(status_json: dict) -> ServerStatus:
+    """
+    Store a new server status and make it the cached latest one
+    :param status_json: The status the poller sent us
+
+    :return: The new ServerStatus
+    """
+    status = ServerStatus(status_json)
+    db.session.add(status)
+    db.session.commit()
+    cache.set(LATEST_STATUS_KEY, {
+        "status_json": status_json,
+        "created_at": status.created_at.isoformat()
+    }, timeout=0)
+    update_presence(status_json)
+    return status
+
+
+def update_presence(status_json: dict):
+    """
+    Rebuild the presence index from the player lists the poller reported
+    :param status_json: Server UUIDs mapped to their online state and player list
+    """
+    # Players are reported by name, everything in the index is keyed by Minecraft UUID
+    members = db.session.query(Character.faction_id, User.minecraft_uuid, User.minecraft_username).join(
+        User, Character.user_id == User.id
+    ).filter(
+        Character.is_active.is_(True),
+        Character.is_permad.is_(False),
+        User.minecraft_uuid.is_not(None)
+    ).all()
+    uuids_by_player = {}
+    for _, minecraft_uuid, minecraft_username in members:
+        uuids_by_player[str(minecraft_uuid)] = str(minecraft_uuid)
+        if minecraft_username:
+            uuids_by_player[minecraft_username.lower()] = str(minecraft_uuid)
+
+    sets = {}
+    online = set()
+    for server_uuid, server in status_json.items():
+        players = server.get("player_list", []) if server.get("online") else []
+        on_server = {uuids_by_player[player.lower()] for player in players if player.lower() in uuids_by_player}
+        sets[get_server_key(server_uuid)] = on_server
+        online |= on_server
+
+    for (faction_id,) in db.session.query(Faction.id).all():
+        sets[get_faction_key(faction_id, "members")] = set()
+        sets[get_faction_key(faction_id, "online")] = set()
+    for faction_id, minecraft_uuid, _ in members:
+        minecraft_uuid = str(minecraft_uuid)
+        sets[get_faction_key(faction_id, "members")].add(minecraft_uuid)
+        if minecraft_uuid in online:
+            sets[get_faction_key(faction_id, "online")].add(minecraft_uuid)
+    presence.replace(sets)
+
+
+def get_latest_server_status():
+    """
+    Get the newest server status, only going to the database when the cache is cold
+
+    :return: Dict with the status_json and when it was created, or None if we've never had one
+    """
+    latest = cache.get(LATEST_STATUS_KEY)
+    if latest is not None:
+        return latest
+    status = ServerStatus.query.order_by(ServerStatus.created_at.desc()).first()
+    if status is None:
+        return None
+    latest = {"status_json": status.status_json, "created_at": status.created_at.isoformat()}
+    # Only fill it if nothing newer was recorded while we were querying
+    cache.add(LATEST_STATUS_KEY, latest, timeout=0)
+    return latest
+
+
+def prune_server_statuses():
+    """
+    Delete server statuses older than the retention period, a batch at a time
+    so we never hold locks on the table for long.
+    """
+    cutoff = dt.utcnow() - timedelta(hours=app.config["SERVER_STATUS_RETENTION_HOURS"])
+    batch_size = app.config["SERVER_STATUS_PRUNE_BATCH_SIZE"]
+    deleted = 0
+    while True:
+        batch = db.session.query(ServerStatus.id).filter(
+            ServerStatus.created_at < cutoff
+        ).order_by(ServerStatus.created_at).limit(batch_size).subquery()
+        count = ServerStatus.query.filter(
+            ServerStatus.id.in_(db.select(batch.c.id))
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += count
+        if count < batch_size:
+            break
+    if deleted:
+        print(f"Pruned {deleted} old server statuses")
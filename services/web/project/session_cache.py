@@ -0,0 +1,172 @@
+import struct
+import uuid
+
+from .extensions import cache, invalidation_bus
+from .local_cache import LocalCache
+
+SESSION_TOPIC = "session"
+
+# Bump this whenever the layout below changes, old entries then simply miss
+SESSION_SCHEMA_VERSION = 1
+
+# flags, user id, session id
+_HEADER = struct.Struct("!BI16s")
+_STRING_LENGTH = struct.Struct("!H")
+_NONE_LENGTH = 0xFFFF
+
+_FLAG_ADMIN = 1
+_FLAG_STAFF = 2
+_FLAG_WHITELISTED = 4
+
+# Process-local tier in front of Redis, most authenticated requests are served from here
+local_sessions = LocalCache()
+
+
+class SessionUser:
+    """
+    The slice of a User that's needed to serve a request as them.
+    This is what ends up in current_user, anything else should be queried from the User model.
+    """
+    __slots__ = ("id", "session_id", "username", "is_admin", "is_staff", "is_whitelisted",
+                 "minecraft_uuid", "discord_uuid", "site_theme")
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, user_id, session_id, username, is_admin=False, is_staff=False, is_whitelisted=False,
+                 minecraft_uuid=None, discord_uuid=None, site_theme=None):
+        self.id = user_id
+        self.session_id = session_id
+        self.username = username
+        self.is_admin = is_admin
+        self.is_staff = is_staff
+        self.is_whitelisted = is_whitelisted
+        self.minecraft_uuid = minecraft_uuid
+        self.discord_uuid = discord_uuid
+        self.site_theme = site_theme
+
+    def __repr__(self):
+        return f'<SessionUser {self.username} {self.id}>'
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            user_id=user.id,
+            session_id=str(user.session_id),
+            username=user.username,
+            is_admin=user.is_admin,
+            is_staff=user.is_staff,
+            is_whitelisted=user.is_whitelisted,
+            minecraft_uuid=user.minecraft_uuid,
+            discord_uuid=user.discord_uuid,
+            site_theme=user.site_theme
+        )
+
+    def dumps(self) -> bytes:
+        flags = (_FLAG_ADMIN if self.is_admin else 0) \
+            | (_FLAG_STAFF if self.is_staff else 0) \
+            | (_FLAG_WHITELISTED if self.is_whitelisted else 0)
+        parts = [_HEADER.pack(flags, self.id, uuid.UUID(self.session_id).bytes)]
+        for value in (self.username, self.minecraft_uuid, self.discord_uuid, self.site_theme):
+            if value is None:
+                parts.append(_STRING_LENGTH.pack(_NONE_LENGTH))
+            else:
+                encoded = value.encode()
+                parts.append(_STRING_LENGTH.pack(len(encoded)))
+                parts.append(encoded)
+        return b"".join(parts)
+
+    @classmethod
+    def loads(cls, payload: bytes):
+        flags, user_id, session_id = _HEADER.unpack_from(payload)
+        offset = _HEADER.size
+        strings = []
+        for _ in range(4):
+            (length,) = _STRING_LENGTH.unpack_from(payload, offset)
+            offset += _STRING_LENGTH.size
+            if length == _NONE_LENGTH:
+                strings.append(None)
+            else:
+                strings.append(payload[offset:offset + length].decode())
+                offset += length
+        username, minecraft_uuid, discord_uuid, site_theme = strings
+        return cls(
+            user_id=user_id,
+            session_id=str(uuid.UUID(bytes=session_id)),
+            username=username,
+            is_admin=bool(flags & _FLAG_ADMIN),
+            is_staff=bool(flags & _FLAG_STAFF),
+            is_whitelisted=bool(flags & _FLAG_WHITELISTED),
+            minecraft_uuid=minecraft_uuid,
+            discord_uuid=discord_uuid,
+            site_theme=site_theme
+        )
+
+    def get_id(self):
+        return self.session_id
+
+    def is_elevated(self):
+        return self.is_admin or self.is_staff
+
+    def minecraft_uuid_as_plain(self):
+        if self.minecraft_uuid is None:
+            # Return a null UUID
+            return '00000000000000000000000000000000'
+        return self.minecraft_uuid.replace('-', '')
+
+    def get_avatar_link(self, size=150, skin_type='helm'):
+        if self.minecraft_uuid is not None:
+            return f"https://minotar.net/{skin_type}/{self.minecraft_uuid_as_plain()}/{size}"
+        else:
+            return "https://minotar.net/helm/MHF_Steve/150"
+
+
+def init_app(app):
+    local_sessions.maxsize = app.config["SESSION_LOCAL_CACHE_SIZE"]
+    local_sessions.ttl = app.config["SESSION_LOCAL_CACHE_TTL"]
+
+
+def get_session_cache_key(session_id) -> str:
+    return f"user_v{SESSION_SCHEMA_VERSION}_{session_id}"
+
+
+def get_cached_session(session_id):
+    """
+    Get a cached session, checking the process-local tier before Redis
+    :param session_id: Session ID of the user
+
+    :return: The cached payload, b"" if the session doesn't belong to anyone, or None on a miss
+    """
+    cache_key = get_session_cache_key(session_id)
+    payload = local_sessions.get(cache_key)
+    if payload is None:
+        payload = cache.get(cache_key)
+        if payload is not None:
+            local_sessions.set(cache_key, payload)
+    return payload
+
+
+def set_cached_session(session_id, payload, timeout=3600):
+    cache_key = get_session_cache_key(session_id)
+    cache.set(cache_key, payload, timeout=timeout)
+    local_sessions.set(cache_key, payload)
+
+
+def invalidate_session(session_id):
+    """
+    Drop a session from Redis and from the local tier of every worker
+    :param session_id: Session ID of the user
+    """
+    cache.delete(get_session_cache_key(session_id))
+    invalidation_bus.publish(SESSION_TOPIC, str(session_id))
+
+
+def _on_session_invalidated(session_id):
+    if session_id is None:
+        local_sessions.clear()
+    else:
+        local_sessions.delete(get_session_cache_key(session_id))
+
+
+invalidation_bus.subscribe(SESSION_TOPIC, _on_session_invalidated)
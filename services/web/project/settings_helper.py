@@ -1,10 +1,27 @@
 from .models import SystemSetting, db
-from .extensions import cache
+from .extensions import cache, invalidation_bus
+from .local_cache import VersionedSnapshot
+
+SETTINGS_TOPIC = 'site_settings'
+SETTINGS_VERSION_KEY = 'site_settings_version'
+
+# Every worker keeps the settings in memory and only reloads them when the version is bumped
+site_settings_snapshot = VersionedSnapshot()
+
+
+def get_site_settings():
+    """
+    Get all the site settings, served from this process' snapshot
+    The returned dict is shared, so don't modify it
+
+    :return: Settings dict
+    """
+    return site_settings_snapshot.get(load_site_settings)
 
 
 # This is a new function that just gets all the settings and returns them as a dict
 @cache.cached(timeout=0, key_prefix='site_settings')
-def get_site_settings():
+def load_site_settings():
     settings = SystemSetting.query.first()
     return_dict = {
         "application_settings": {
@@ -39,9 +56,15 @@ def get_site_settings():
 
 def clear_site_settings_cache():
     cache.delete('site_settings')
+    # Atomic in Redis, so every save gets its own version even across workers
+    version = cache.cache.inc(SETTINGS_VERSION_KEY)
+    invalidation_bus.publish(SETTINGS_TOPIC, version)
+
+
+invalidation_bus.subscribe(SETTINGS_TOPIC, site_settings_snapshot.advance)
 
 
-@cache.cached(timeout=0, key_prefix='server_settings')
+# This is built from the in-memory settings, so it's cheaper than a cache lookup
 def get_server_settings():
     settings = get_site_settings()
     return {
@@ -60,64 +83,74 @@ def get_server_settings():
     }
 
 
-def set_applications_status(status: bool):
+def update_settings(changes: dict) -> dict:
+    """
+    Apply a batch of setting changes in one UPDATE and one commit
+    :param changes: Mapping of SystemSetting column names to their new values
+
+    :return: The changes that actually differed from what was stored
+    """
+    columns = SystemSetting.__table__.columns.keys()
+    unknown = [name for name in changes if name not in columns]
+    if unknown:
+        raise ValueError(f"Unknown settings: {', '.join(unknown)}")
+
     setting = SystemSetting.query.first()
-    setting.applications_open = status
-    db.session.commit()
-    clear_site_settings_cache()
+    applied = {}
+    for name, value in changes.items():
+        if getattr(setting, name) != value:
+            setattr(setting, name, value)
+            applied[name] = value
+
+    # Nothing changed, so there's nothing to commit or invalidate
+    if applied:
+        db.session.commit()
+        clear_site_settings_cache()
+    return applied
+
+
+def set_applications_status(status: bool):
+    update_settings({"applications_open": status})
 
 
 def set_can_register(status: bool):
-    setting = SystemSetting.query.first()
-    setting.can_register = status
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({"can_register": status})
 
 
 def set_join_discord(status: bool):
-    setting = SystemSetting.query.first()
-    setting.join_discord_on_register = status
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({"join_discord_on_register": status})
 
 
 def set_site_theme(theme: str):
-    setting = SystemSetting.query.first()
-    setting.site_theme = theme
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({"site_theme": theme})
 
 
 def set_panel_settings(panel_api_key: str, panel_api_url: str):
-    setting = SystemSetting.query.first()
-    setting.panel_api_key = panel_api_key
-    setting.panel_api_url = panel_api_url
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({
+        "panel_api_key": panel_api_key,
+        "panel_api_url": panel_api_url
+    })
 
 
 def set_server_settings(live_server_uuid: str, staging_server_uuid: str, fallback_server_uuid: str):
-    setting = SystemSetting.query.first()
-    setting.live_server_uuid = live_server_uuid
-    setting.staging_server_uuid = staging_server_uuid
-    setting.fallback_server_uuid = fallback_server_uuid
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({
+        "live_server_uuid": live_server_uuid,
+        "staging_server_uuid": staging_server_uuid,
+        "fallback_server_uuid": fallback_server_uuid
+    })
 
 
 def set_application_settings(minimum_length: int, maximum_length: int):
-    setting = SystemSetting.query.first()
-    setting.minimum_length = minimum_length
-    setting.maximum_length = maximum_length
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({
+        "minimum_length": minimum_length,
+        "maximum_length": maximum_length
+    })
 
 
 def set_webhook_settings(ticket, application, general, dev):
-    setting = SystemSetting.query.first()
-    setting.ticket_webhook = ticket
-    setting.application_webhook = application
-    setting.general_webhook = general
-    setting.dev_webhook = dev
-    db.session.commit()
-    clear_site_settings_cache()
+    update_settings({
+        "ticket_webhook": ticket,
+        "application_webhook": application,
+        "general_webhook": general,
+        "dev_webhook": dev
+    })
@@ -0,0 +1,118 @@
+import re
+import threading
+import time
+from collections import Counter, deque
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Lists of bind parameters, e.g. the expanded "IN (%(id_1)s, %(id_2)s)", collapse to one placeholder
+_PARAMETER_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\([^)]+\)s|\$\d+)\s*,?)+\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def get_statement_shape(statement: str) -> str:
+    return _PARAMETER_LIST.sub("(?)", _WHITESPACE.sub(" ", statement)).strip()
+
+
+class SQLProfiler:
+    """
+    Counts the statements and database time of every request and keeps the worst ones
+    in a ring buffer. A statement shape that repeats within one request is reported as
+    an N+1 suspect, that's usually a lazy loaded relationship inside a loop.
+    """
+
+    def __init__(self):
+        self.min_statements = 20
+        self.n_plus_one_threshold = 5
+        self.slow_request_ms = 250
+        self._requests = deque(maxlen=100)
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        if not app.config["SQL_PROFILER_ENABLED"]:
+            return
+        self.min_statements = app.config["SQL_PROFILER_MIN_STATEMENTS"]
+        self.n_plus_one_threshold = app.config["SQL_PROFILER_N_PLUS_ONE_THRESHOLD"]
+        self.slow_request_ms = app.config["SQL_PROFILER_SLOW_REQUEST_MS"]
+        self._requests = deque(maxlen=app.config["SQL_PROFILER_HISTORY"])
+        event.listen(Engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", self._after_cursor_execute)
+        app.teardown_request(self._teardown_request)
+
+    @staticmethod
+    def _before_cursor_execute(_conn, _cursor, _statement, _parameters, context, _executemany):
+        if has_request_context():
+            context._profiler_start = time.perf_counter()
+
+    @staticmethod
+    def _after_cursor_execute(_conn, _cursor, statement, _parameters, context, _executemany):
+        start = getattr(context, "_profiler_start", None)
+        if start is None or not has_request_context():
+            return
+        profile = g.get("_sql_profile")
+        if profile is None:
+            profile = g._sql_profile = {"count": 0, "time": 0.0, "shapes": Counter()}
+        profile["count"] += 1
+        profile["time"] += time.perf_counter() - start
+        profile["shapes"][get_statement_shape(statement)] += 1
+
+    def _teardown_request(self, _exc):
+        profile = g.pop("_sql_profile", None)
+        if profile is None:
+            return
+        db_time_ms = profile["time"] * 1000
+        suspects = [
+            {"statement": shape, "count": count}
+            for shape, count in profile["shapes"].most_common()
+            if count >= self.n_plus_one_threshold
+        ]
+        if not suspects and profile["count"] < self.min_statements and db_time_ms < self.slow_request_ms:
+            return
+        with self._lock:
+            self._requests.append({
+                "endpoint": request.endpoint,
+                "method": request.method,
+                "path": request.path,
+                "statements": profile["count"],
+                "distinct_statements": len(profile["shapes"]),
+                "db_time_ms": round(db_time_ms, 3),
+                "n_plus_one": suspects,
+                "recorded_at": time.time()
+            })
+
+    def worst_requests(self) -> list:
+        with self._lock:
+            recorded = list(self._requests)
+        return sorted(recorded, key=lambda r: (r["db_time_ms"], r["statements"]), reverse=True)
+
+    def worst_endpoints(self) -> list:
+        """
+        Roll the recorded requests up by endpoint
+
+        :return: One entry per endpoint, worst first
+        """
+        endpoints = {}
+        for recorded in self.worst_requests():
+            entry = endpoints.setdefault(recorded["endpoint"], {
+                "endpoint": recorded["endpoint"],
+                "requests": 0,
+                "max_statements": 0,
+                "max_db_time_ms": 0.0,
+                "n_plus_one": set()
+            })
+            entry["requests"] += 1
+            entry["max_statements"] = max(entry["max_statements"], recorded["statements"])
+            entry["max_db_time_ms"] = max(entry["max_db_time_ms"], recorded["db_time_ms"])
+            entry["n_plus_one"].update(suspect["statement"] for suspect in recorded["n_plus_one"])
+        for entry in endpoints.values():
+            entry["n_plus_one"] = sorted(entry["n_plus_one"])
+        return sorted(endpoints.values(), key=lambda e: (e["max_db_time_ms"], e["max_statements"]), reverse=True)
+
+    def clear(self):
+        with self._lock:
+            self._requests.clear()
+
+
+sql_profiler = SQLProfiler()
@@ -0,0 +1,271 @@
+import atexit
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+
+import redis
+import requests
+
+from .local_cache import get_redis_client
+
+QUEUE_KEY = "webhook_queue"
+# Never wait longer than this between retries, however many attempts it's been
+MAX_BACKOFF = 300
+# Discord's limits for a single message
+MAX_EMBEDS = 10
+MAX_EMBED_CHARACTERS = 6000
+
+
+class MemoryDeliveryStore:
+    """
+    In-process delivery store, used when there's no Redis to persist the queue in.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def push(self, delivery, due):
+        with self._lock:
+            heapq.heappush(self._heap, (due, next(self._counter), delivery))
+
+    def pop_due(self):
+        with self._lock:
+            if self._heap and self._heap[0][0] <= time.time():
+                return heapq.heappop(self._heap)[2]
+        return None
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class RedisDeliveryStore:
+    """
+    Deliveries live in a Redis sorted set scored by when they're due,
+    so they survive restarts and are shared by every worker process.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def push(self, delivery, due):
+        self._client.zadd(QUEUE_KEY, {json.dumps(delivery): due})
+
+    def pop_due(self):
+        due = self._client.zrangebyscore(QUEUE_KEY, "-inf", time.time(), start=0, num=1)
+        # Whoever removes it gets to deliver it, another worker may have beaten us to it
+        if due and self._client.zrem(QUEUE_KEY, due[0]):
+            return json.loads(due[0])
+        return None
+
+    def __len__(self):
+        return self._client.zcard(QUEUE_KEY)
+
+
+def get_retry_after(response) -> float:
+    """
+    Work out how long Discord wants us to back off for
+    :param response: The 429 response
+
+    :return: Seconds to wait
+    """
+    header = response.headers.get("Retry-After") or response.headers.get("X-RateLimit-Reset-After")
+    if header:
+        return float(header)
+    try:
+        retry_after = float(response.json()["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return 1.0
+    # Older API versions report milliseconds
+    return retry_after / 1000 if retry_after > 60 else retry_after
+
+
+def get_embed_length(embed: dict) -> int:
+    # Discord counts these towards the 6000 character limit of a message
+    length = len(embed.get("title") or "") + len(embed.get("description") or "")
+    length += len((embed.get("footer") or {}).get("text") or "")
+    length += len((embed.get("author") or {}).get("name") or "")
+    for field in embed.get("fields") or []:
+        length += len(field.get("name") or "") + len(field.get("value") or "")
+    return length
+
+
+def coalesce_payloads(payloads: list) -> list:
+    """
+    Merge embed-only messages for the same webhook into as few messages as Discord allows
+    :param payloads: Message payloads in the order they were sent
+
+    :return: The merged payloads
+    """
+    messages = []
+    current = None
+    current_length = 0
+    for payload in payloads:
+        username = payload.get("username")
+        avatar_url = payload.get("avatar_url")
+        for embed in payload["embeds"]:
+            embed_length = get_embed_length(embed)
+            if current is None or len(current["embeds"]) >= MAX_EMBEDS \
+                    or current_length + embed_length > MAX_EMBED_CHARACTERS:
+                current = {"username": username, "avatar_url": avatar_url, "embeds": []}
+                current_length = 0
+                messages.append(current)
+            if username and username != current["username"] and not embed.get("author"):
+                # The message can only have one sender, so keep who it was from on the embed
+                embed = dict(embed, author={"name": username, "icon_url": avatar_url})
+                embed_length += len(username)
+            current["embeds"].append(embed)
+            current_length += embed_length
+    return messages
+
+
+class WebhookQueue:
+    """
+    Delivers Discord webhooks from a small pool of worker threads so requests never wait on Discord.
+    Rate limits are tracked per webhook URL, and failed deliveries are retried with exponential backoff.
+    Embed-only messages are held for a short window per URL so a burst of events goes out as a few
+    multi-embed messages instead of one request each.
+    """
+
+    def __init__(self):
+        self.worker_count = 2
+        self.max_attempts = 5
+        self.timeout = 10
+        self.poll_interval = 0.5
+        self.coalesce_window = 2.0
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._store = MemoryDeliveryStore()
+        self._session = requests.Session()
+        self._blocked_until = {}
+        self._workers_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.worker_count = app.config["WEBHOOK_WORKERS"]
+        self.max_attempts = app.config["WEBHOOK_MAX_ATTEMPTS"]
+        self.timeout = app.config["WEBHOOK_TIMEOUT"]
+        self.coalesce_window = app.config["WEBHOOK_COALESCE_WINDOW"]
+        client = get_redis_client(app)
+        if client is not None:
+            self._store = RedisDeliveryStore(client)
+        # Don't lose what's still being held for coalescing when the worker process shuts down
+        atexit.register(self.flush)
+
+    def enqueue(self, url: str, payload: dict):
+        """
+        Queue a webhook message for delivery
+        :param url: Discord webhook URL
+        :param payload: JSON body of the message
+        """
+        if not url or not url.startswith("http"):
+            # Webhooks that haven't been set up yet are still CHANGE_ME
+            return
+        if self.coalesce_window > 0 and payload.get("embeds") and not payload.get("content"):
+            self._hold(url, payload)
+            return
+        self._push(url, payload)
+
+    def _hold(self, url, payload):
+        with self._pending_lock:
+            pending = self._pending.get(url)
+            if pending is None:
+                pending = self._pending[url] = []
+                timer = threading.Timer(self.coalesce_window, self.flush, args=(url,))
+                timer.daemon = True
+                timer.start()
+            pending.append(payload)
+
+    def flush(self, url=None):
+        """
+        Queue everything held for coalescing now instead of waiting for the window to close
+        :param url: Only flush this webhook URL, defaults to all of them
+        """
+        with self._pending_lock:
+            urls = [url] if url is not None else list(self._pending)
+            held = [(pending_url, self._pending.pop(pending_url, [])) for pending_url in urls]
+        for pending_url, payloads in held:
+            for payload in coalesce_payloads(payloads):
+                self._push(pending_url, payload)
+
+    def _push(self, url, payload):
+        delivery = {"id": uuid.uuid4().hex, "url": url, "payload": payload, "attempt": 0}
+        try:
+            self._store.push(delivery, time.time())
+        except redis.exceptions.RedisError as e:
+            print(f"Failed to queue webhook: {e}")
+            return
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        # Threads don't survive a fork, so every worker process starts its own on first use
+        if self._workers_pid == os.getpid():
+            return
+        with self._lock:
+            if self._workers_pid == os.getpid():
+                return
+            for _ in range(self.worker_count):
+                threading.Thread(target=self._work, daemon=True).start()
+            self._workers_pid = os.getpid()
+
+    def _work(self):
+        while True:
+            try:
+                delivery = self._store.pop_due()
+            except redis.exceptions.RedisError as e:
+                print(f"Failed to read the webhook queue: {e}")
+                time.sleep(5)
+                continue
+            if delivery is None:
+                time.sleep(self.poll_interval)
+                continue
+            try:
+                self._deliver(delivery)
+            # A bad delivery mustn't take the worker down with it
+            # skipcq: PYL-W0703
+            except Exception as e:
+                print(f"Unexpected error delivering webhook: {e}")
+
+    def _deliver(self, delivery):
+        url = delivery["url"]
+        blocked_until = self._blocked_until.get(url, 0)
+        if blocked_until > time.time():
+            self._store.push(delivery, blocked_until)
+            return
+
+        try:
+            response = self._session.post(url, json=delivery["payload"], params={"wait": "true"}, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            self._retry(delivery, str(e))
+            return
+
+        if response.headers.get("X-RateLimit-Remaining") == "0" and response.headers.get("X-RateLimit-Reset-After"):
+            # We're allowed this one but the bucket is empty, hold off the next ones
+            self._blocked_until[url] = time.time() + float(response.headers["X-RateLimit-Reset-After"])
+
+        if response.status_code == 429:
+            # Discord tells us exactly when to come back, so this doesn't count as a failed attempt
+            retry_at = time.time() + get_retry_after(response)
+            self._blocked_until[url] = retry_at
+            self._store.push(delivery, retry_at)
+        elif response.status_code >= 500:
+            self._retry(delivery, f"status code {response.status_code}")
+        elif response.status_code >= 400:
+            print(f"Webhook rejected with status code {response.status_code}: {response.text}")
+
+    def _retry(self, delivery, reason):
+        delivery["attempt"] += 1
+        if delivery["attempt"] >= self.max_attempts:
+            print(f"Giving up on webhook after {delivery['attempt']} attempts: {reason}")
+            return
+        delay = min(2 ** delivery["attempt"], MAX_BACKOFF)
+        print(f"Webhook delivery failed ({reason}), retrying in {delay} seconds")
+        self._store.push(delivery, time.time() + delay)
+
+
+webhook_queue = WebhookQueue()
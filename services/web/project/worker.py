@@ -0,0 +1,58 @@
+import time
+
+import click
+
+from .models import db
+
+
+class Worker:
+    """
+    Runs periodic background jobs in their own process, started with `flask worker`.
+    A job returns how many seconds until it next has work due, or None to run again after its interval.
+    """
+
+    def __init__(self):
+        self._jobs = []
+
+    def init_app(self, app):
+        @app.cli.command("worker")
+        @click.option("--once", is_flag=True, help="Run every job once and exit")
+        def worker_command(once):
+            """Run the background jobs."""
+            self.run(app, once=once)
+
+    def register(self, name: str, func, interval: float):
+        """
+        Register a periodic job
+        :param name: Name to log the job under
+        :param func: Called with no arguments inside an app context
+        :param interval: Longest time in seconds between runs
+        """
+        self._jobs.append({"name": name, "func": func, "interval": interval, "next_run": 0.0})
+
+    def run_job(self, app, job):
+        with app.app_context():
+            try:
+                due_in = job["func"]()
+            # One failing job mustn't stop the others
+            # skipcq: PYL-W0703
+            except Exception as e:
+                print(f"Job {job['name']} failed: {e}")
+                db.session.rollback()
+                due_in = None
+        delay = job["interval"] if due_in is None else max(0.0, min(due_in, job["interval"]))
+        job["next_run"] = time.monotonic() + delay
+
+    def run(self, app, once=False):
+        print(f"Worker started with jobs: {', '.join(job['name'] for job in self._jobs)}")
+        while True:
+            for job in self._jobs:
+                if once or job["next_run"] <= time.monotonic():
+                    self.run_job(app, job)
+            if once:
+                return
+            next_run = min((job["next_run"] for job in self._jobs), default=time.monotonic() + 60)
+            time.sleep(max(0.1, next_run - time.monotonic()))
+
+
+worker = Worker()